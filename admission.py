@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+from metrics import admission_rejections_total, admission_queue_depth
+
+logger = logging.getLogger(__name__)
+
+# Limites do payload das análises: tamanho do corpo (bytes), mensagens por requisição e
+# caracteres por mensagem. Corpos maiores são recusados com 413 sem serem lidos até o fim.
+ADMISSION_MAX_BODY_BYTES = int(os.getenv("ADMISSION_MAX_BODY_BYTES", 512 * 1024))
+ADMISSION_MAX_MESSAGES = int(os.getenv("ADMISSION_MAX_MESSAGES", 50))
+ADMISSION_MAX_MESSAGE_CHARS = int(os.getenv("ADMISSION_MAX_MESSAGE_CHARS", 5000))
+
+# Análises em andamento por processo; as que passarem disso esperam numa fila limitada
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 16))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 32))
+# Espera máxima por uma vaga antes de devolver 503 (0 recusa na hora quando não há vaga)
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 10.0))
+# Análises simultâneas (em andamento ou na fila) de um mesmo cliente; acima disso, 429
+ADMISSION_MAX_PER_CLIENT = int(os.getenv("ADMISSION_MAX_PER_CLIENT", 4))
+# Duração presumida de uma análise para o Retry-After enquanto não há medições
+ADMISSION_RETRY_AFTER_SECONDS = float(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5.0))
+
+# Rotas que passam pelo controle de vagas (as que consomem cota dos provedores na hora)
+ADMISSION_PATHS = ("/analyze", "/analyze/stream")
+
+# Proxies confiáveis na frente da API (ex.: o do Railway), cada um acrescentando um IP ao fim
+# do X-Forwarded-For. O cliente é o IP que o mais externo deles viu; os anteriores vêm do
+# próprio cliente e podem ser forjados. Com 0 (padrão) o cabeçalho é ignorado e vale o IP da
+# conexão; atrás do proxy do Railway configure 1.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+
+# Peso da requisição mais recente na média móvel da duração das análises
+DURATION_SMOOTHING = 0.1
+
+
+def client_identity(scope, trusted_hops=TRUSTED_PROXY_HOPS):
+    """Identifica o cliente pelo escopo ASGI (IP visto pelo proxy confiável, se houver)"""
+    if trusted_hops > 0:
+        hops = [
+            hop.strip()
+            for name, value in scope.get("headers", ())
+            if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",")
+        ]
+        hops = [hop for hop in hops if hop]
+        if hops:
+            # Com menos IPs que proxies confiáveis, todos foram acrescentados por eles
+            return hops[-min(trusted_hops, len(hops))]
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
+
+
+class AdmissionRejected(Exception):
+    """A requisição não foi admitida; `status_code` e `retry_after` vão para a resposta"""
+
+    def __init__(self, status_code, reason, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+        self.message = message
+
+
+class AdmissionController:
+    """
+    Limita as análises em andamento e a fila de espera por elas.\n
+    Até `max_in_flight` requisições rodam ao mesmo tempo; as seguintes aguardam em ordem de
+    chegada, no máximo `max_queue` delas e por até `queue_timeout` segundos. Quem não cabe
+    na fila ou não consegue vaga a tempo recebe 503, e o cliente que já tem
+    `max_per_client` requisições em andamento ou na fila recebe 429, de modo que uma
+    rajada de um só cliente não ocupa a fila dos demais. O Retry-After sugerido vem da
+    duração média das análises e do tamanho da fila.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+        max_queue=ADMISSION_MAX_QUEUE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+        max_per_client=ADMISSION_MAX_PER_CLIENT,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.max_per_client = max_per_client
+        self._in_flight = 0
+        self._waiters = deque()
+        self._per_client = {}
+        self._average_duration = None
+
+        self.admitted = 0
+        self.rejected = {}
+        admission_queue_depth.set_function(lambda: len(self._waiters))
+
+    def retry_after(self, queued=None):
+        """Segundos sugeridos até haver vaga, considerando quem já está na fila"""
+        duration = self._average_duration or ADMISSION_RETRY_AFTER_SECONDS
+        queued = len(self._waiters) if queued is None else queued
+        return max(1, math.ceil(duration * (queued + 1) / self.max_in_flight))
+
+    def _reject(self, status_code, reason, retry_after, message):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        admission_rejections_total.labels(reason).inc()
+        logger.warning(f"Requisição recusada pelo controle de admissão ({reason}): {message}")
+        raise AdmissionRejected(status_code, reason, retry_after, message)
+
+    async def acquire(self, client_id):
+        """Aguarda uma vaga para `client_id` ou levanta AdmissionRejected"""
+        if self.max_per_client and self._per_client.get(client_id, 0) >= self.max_per_client:
+            self._reject(
+                status.HTTP_429_TOO_MANY_REQUESTS, "client_limit", self.retry_after(queued=0),
+                f"Cliente {client_id} já tem {self.max_per_client} análises em andamento",
+            )
+
+        # O cliente passa a contar já na fila, para não ocupá-la sozinho
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        try:
+            await self._wait_for_slot()
+        except BaseException:
+            self._forget_client(client_id)
+            raise
+        self.admitted += 1
+
+    async def _wait_for_slot(self):
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+        elif len(self._waiters) >= self.max_queue or self.queue_timeout <= 0:
+            self._reject(
+                status.HTTP_503_SERVICE_UNAVAILABLE, "queue_full", self.retry_after(),
+                f"Fila de análises cheia ({len(self._waiters)} aguardando)",
+            )
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except (TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    # A vaga chegou junto com o cancelamento: é devolvida a quem está na fila
+                    self._hand_over()
+                else:
+                    future.cancel()
+                    self._waiters.remove(future)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject(
+                    status.HTTP_503_SERVICE_UNAVAILABLE, "queue_timeout", self.retry_after(),
+                    f"Nenhuma vaga livre em {self.queue_timeout:.1f}s",
+                )
+
+    def _hand_over(self):
+        """Passa a vaga liberada direto ao próximo da fila (ou a devolve ao total livre)"""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _forget_client(self, client_id):
+        remaining = self._per_client.get(client_id, 1) - 1
+        if remaining > 0:
+            self._per_client[client_id] = remaining
+        else:
+            self._per_client.pop(client_id, None)
+
+    def release(self, client_id, duration):
+        self._forget_client(client_id)
+        if self._average_duration is None:
+            self._average_duration = duration
+        else:
+            self._average_duration += DURATION_SMOOTHING * (duration - self._average_duration)
+        self._hand_over()
+
+    def stats(self):
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "clients": len(self._per_client),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "average_duration_seconds": self._average_duration or 0.0,
+        }
+
+
+admission_controller = AdmissionController()
+
+
+def _body_too_large(max_body_bytes):
+    admission_rejections_total.labels("body_too_large").inc()
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Corpo da requisição maior que o limite de {max_body_bytes} bytes",
+    )
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI de controle de admissão.\n
+    Recusa com 413 corpos acima de `max_body_bytes`: pelo Content-Length antes de ler
+    qualquer byte ou, sem ele, assim que o corpo recebido passa do limite. Nas rotas de
+    `paths`, a requisição só segue depois de conseguir uma vaga no `controller`, que a
+    mantém até a resposta terminar (inclusive no streaming). Recusas levam Retry-After.
+    """
+
+    def __init__(self, app, controller=None, paths=ADMISSION_PATHS, max_body_bytes=ADMISSION_MAX_BODY_BYTES):
+        self.app = app
+        self.controller = controller or admission_controller
+        self.paths = set(paths)
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_body_bytes:
+            for name, value in scope.get("headers", ()):
+                if name == b"content-length" and value.isdigit() and int(value) > self.max_body_bytes:
+                    error = _body_too_large(self.max_body_bytes)
+                    response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+                    await response(scope, receive, send)
+                    return
+            receive = self._limited_receive(receive)
+
+        if scope["path"] not in self.paths or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        client_id = client_identity(scope)
+        try:
+            await self.controller.acquire(client_id)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"message": e.message, "reason": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(client_id, time.perf_counter() - start_time)
+
+    def _limited_receive(self, receive):
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # O FastAPI repassa HTTPException levantada durante a leitura do corpo
+                    raise _body_too_large(self.max_body_bytes)
+            return message
+
+        return limited_receive
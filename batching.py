@@ -0,0 +1,164 @@
+import asyncio
+import contextvars
+import logging
+
+from deadline import current_deadline
+from metrics import microbatch_size
+from rate_limiter import current_priority
+
+logger = logging.getLogger(__name__)
+
+# Peso da chegada mais recente na média móvel do intervalo entre chegadas
+ARRIVAL_SMOOTHING = 0.2
+
+
+class _Item:
+    __slots__ = ("value", "future", "context")
+
+    def __init__(self, value, future, context):
+        self.value = value
+        self.future = future
+        self.context = context
+
+
+class MicroBatcher:
+    """
+    Agrupa itens enviados por requisições simultâneas em uma única chamada em lote.\n
+    Cada item entra em uma fila e quem o enviou recebe só a sua fatia do resultado. O lote
+    sai quando chega a `max_batch_size` itens ou quando acaba a janela de espera, que se
+    adapta ao ritmo de chegada (média móvel do intervalo entre itens): com tráfego leve,
+    quando não se espera outro item dentro de `max_wait`, a janela é zero e o item sai na
+    próxima volta do event loop, sem latência extra; sob carga, ela dura o tempo previsto
+    para completar o lote, limitado a `max_wait`. Com `max_concurrent_batches`, enquanto o
+    limite de lotes em andamento estiver ocupado os itens continuam se acumulando.
+    `batch_function(valores)` deve devolver os resultados na mesma ordem dos valores.
+    """
+
+    def __init__(self, name, batch_function, max_batch_size, max_wait, max_concurrent_batches=None):
+        self.name = name
+        self.batch_function = batch_function
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_concurrent_batches = max_concurrent_batches
+        self._pending = []
+        self._timer = None
+        self._in_flight = 0
+        self._interval = None
+        self._last_arrival = None
+
+        self.batches = 0
+        self.items = 0
+        self._size_histogram = microbatch_size.labels(name)
+
+    def _observe_arrival(self, now):
+        if self._last_arrival is not None:
+            # Intervalos muito maiores que a janela dizem o mesmo (tráfego leve); limitá-los
+            # faz a média reagir em poucas chegadas quando começa uma rajada
+            gap = min(now - self._last_arrival, 2 * self.max_wait)
+            if self._interval is None:
+                self._interval = gap
+            else:
+                self._interval += ARRIVAL_SMOOTHING * (gap - self._interval)
+        self._last_arrival = now
+
+    def window(self):
+        """Segundos que vale a pena esperar por mais itens antes de enviar o lote atual"""
+        if self.max_wait <= 0 or self._interval is None or self._interval >= self.max_wait:
+            return 0.0
+        missing = self.max_batch_size - len(self._pending)
+        return min(self.max_wait, missing * self._interval)
+
+    async def submit(self, value):
+        return (await self.submit_many([value]))[0]
+
+    async def submit_many(self, values):
+        """Enfileira vários itens de uma vez (ficam no mesmo lote, se couberem) e devolve os resultados"""
+        loop = asyncio.get_running_loop()
+        self._observe_arrival(loop.time())
+        context = contextvars.copy_context()
+        items = [_Item(value, loop.create_future(), context) for value in values]
+        self._pending.extend(items)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            window = self.window()
+            if window > 0:
+                self._timer = loop.call_later(window, self._flush)
+            else:
+                self._timer = loop.call_soon(self._flush)
+
+        # Cancelar a espera cancela o futuro do item: ele é descartado se o lote ainda não saiu
+        return await asyncio.gather(*(item.future for item in items))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            if self.max_concurrent_batches and self._in_flight >= self.max_concurrent_batches:
+                # Sai quando um dos lotes em andamento terminar (ver _run)
+                return
+            batch = [item for item in self._pending[:self.max_batch_size] if not item.future.done()]
+            del self._pending[:self.max_batch_size]
+            if batch:
+                self._start(batch)
+
+    def _start(self, batch):
+        self._in_flight += 1
+        self.batches += 1
+        self.items += len(batch)
+        self._size_histogram.observe(len(batch))
+        task = asyncio.get_running_loop().create_task(self._run(batch), context=self._batch_context(batch))
+
+        def abandon(_):
+            # Ninguém mais espera por este lote (todos cancelaram): a chamada é cancelada
+            if not task.done() and all(item.future.cancelled() for item in batch):
+                task.cancel()
+
+        for item in batch:
+            item.future.add_done_callback(abandon)
+
+    @staticmethod
+    def _batch_context(batch):
+        """
+        Contexto em que o lote roda: o do primeiro item, com o maior prazo e a maior
+        prioridade entre os itens, para que nenhuma requisição do lote seja prejudicada.
+        """
+        context = batch[0].context.copy()
+        deadlines = [item.context.get(current_deadline) for item in batch]
+        deadline = None if None in deadlines else max(deadlines, key=lambda value: value.expires_at)
+        priority = min(item.context.get(current_priority, 0) for item in batch)
+        context.run(current_deadline.set, deadline)
+        context.run(current_priority.set, priority)
+        return context
+
+    async def _run(self, batch):
+        try:
+            results = await self.batch_function([item.value for item in batch])
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+        except asyncio.CancelledError:
+            for item in batch:
+                item.future.cancel()
+            raise
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+            if self._pending and self._timer is None:
+                self._flush()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": self.items / self.batches if self.batches else 0.0,
+            "pending": len(self._pending),
+            "in_flight": self._in_flight,
+            "window_seconds": self.window(),
+        }
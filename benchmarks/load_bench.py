@@ -0,0 +1,239 @@
+"""
+Teste de carga offline da API, sem gastar cota real do Gemini ou da NLPCloud.
+
+Sobe o servidor falso de stub_servers.py, inicia `uvicorn main:app` apontando
+GEMINI_BASE_URL e NLPCLOUD_BASE_URL para ele e dispara requisições em /health e
+/analyze com concorrência controlada. Para cada cenário informa latência p50/p95/p99,
+requisições por segundo, erros, recusas do controle de admissão (429/503) e chamadas
+aos provedores por requisição. Cada conexão concorrente se identifica como um cliente
+diferente (X-Forwarded-For), como usuários distintos atrás do proxy.
+
+Os resultados são salvos em JSON (por padrão em benchmarks/results/) junto com o
+commit atual, para comparar regressões do pipeline e do rate limiter entre commits.
+
+Uso:
+    python benchmarks/load_bench.py --requests 200 --concurrency 20 --messages 3
+    python benchmarks/load_bench.py --env GEMINI_GENERATION_MODE=batched --baseline benchmarks/results/anterior.json
+    python benchmarks/load_bench.py --workers 4 --gemini-rpm 60 --env GEMINI_MAX_REQUESTS_PER_MINUTE=60
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from stub_servers import StubServer, add_arguments, app_from_arguments
+
+RESULTS_DIRECTORY = os.path.join(ROOT, "benchmarks", "results")
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(durations, errors, shed, elapsed, upstream):
+    ordered = sorted(durations) or [0.0]
+    requests = len(durations) + errors + shed
+    return {
+        "requests": requests,
+        "errors": errors,
+        "shed": shed,
+        "requests_per_second": requests / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "upstream_calls": upstream,
+        "upstream_calls_per_request": {
+            provider: counters["calls"] / requests if requests else 0.0
+            for provider, counters in upstream.items()
+        },
+    }
+
+
+def build_payload(messages, distinct_messages, request_number):
+    """Mensagens da requisição; com `distinct_messages` > 0 elas se repetem entre requisições"""
+    if distinct_messages:
+        return [
+            {"message": f"Mensagem de teste número {(request_number * messages + index) % distinct_messages}"}
+            for index in range(messages)
+        ]
+    return [{"message": f"Mensagem de teste {uuid.uuid4().hex}"} for _ in range(messages)]
+
+
+async def run_scenario(client, stub_client, scenario, args):
+    await stub_client.post("/_reset")
+    durations = []
+    errors = 0
+    shed = 0
+    counter = iter(range(args.requests))
+
+    async def worker(user):
+        nonlocal errors, shed
+        headers = {"X-Forwarded-For": f"10.0.{user // 256}.{user % 256}"}
+        for request_number in counter:
+            start = time.perf_counter()
+            try:
+                if scenario == "health":
+                    response = await client.get("/health")
+                else:
+                    payload = build_payload(args.messages, args.distinct_messages, request_number)
+                    response = await client.post("/analyze", json=payload, headers=headers)
+                if response.status_code in (429, 503):
+                    shed += 1
+                    continue
+                response.raise_for_status()
+                durations.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    upstream = (await stub_client.get("/_stats")).json()
+    return summarize(durations, errors, shed, elapsed, upstream)
+
+
+def start_app(args, stub_url, log_directory):
+    """Inicia a API em um subprocesso, com diretório de trabalho temporário (logs, cache, jobs)"""
+    environment = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        GEMINI_BASE_URL=stub_url,
+        NLPCLOUD_BASE_URL=stub_url,
+        PROVIDER_TRANSPORT="http",
+        CACHE_BACKEND=args.cache_backend,
+        RATE_LIMIT_BACKEND="sqlite" if args.workers > 1 else "memory",
+        TRUSTED_PROXY_HOPS="1",
+    )
+    environment.update(dict(item.split("=", 1) for item in args.env))
+    log_file = open(os.path.join(log_directory, "uvicorn.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        cwd=log_directory,
+        env=environment,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    return process, log_file
+
+
+async def wait_until_ready(client, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("A API encerrou durante o startup; veja uvicorn.log")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("A API não respondeu a tempo")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def print_report(results, baseline=None):
+    print(f"{'cenário':<10} {'req/s':>8} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'erros':>6} {'recusas':>8} "
+          f"{'gemini/req':>11} {'nlpcloud/req':>13} {'429':>5}")
+    for scenario, stats in results["scenarios"].items():
+        per_request = stats["upstream_calls_per_request"]
+        print(
+            f"{scenario:<10} {stats['requests_per_second']:>8.1f} {stats['p50_ms']:>10.1f} {stats['p95_ms']:>10.1f} "
+            f"{stats['p99_ms']:>10.1f} {stats['errors']:>6} {stats.get('shed', 0):>8} {per_request['gemini']:>11.2f} "
+            f"{per_request['nlpcloud']:>13.2f} "
+            f"{sum(counters['rate_limited'] for counters in stats['upstream_calls'].values()):>5}"
+        )
+        previous = (baseline or {}).get("scenarios", {}).get(scenario)
+        if previous:
+            changes = ", ".join(
+                f"{metric} {(stats[metric] / previous[metric] - 1) * 100:+.1f}%"
+                for metric in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")
+                if previous[metric]
+            )
+            print(f"{'':<10} em relação a {baseline['commit']}: {changes}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=["health", "analyze"], choices=["health", "analyze"])
+    parser.add_argument("--requests", type=int, default=100, help="requisições por cenário")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=3, help="mensagens por requisição em /analyze")
+    parser.add_argument("--distinct-messages", type=int, default=0,
+                        help="tamanho do conjunto de mensagens repetidas (0 = todas únicas, sem efeito de cache)")
+    parser.add_argument("--cache-backend", default="none", help="CACHE_BACKEND usado pela API")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos do uvicorn; acima de 1 a cota do Gemini é compartilhada via SQLite")
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="variável de ambiente extra para a API (pode repetir)")
+    parser.add_argument("--app-port", type=int, default=8090)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: benchmarks/results/<data>_<commit>.json)")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scenarios": {},
+    }
+
+    with StubServer(app_from_arguments(args), port=args.stub_port) as stub, \
+            tempfile.TemporaryDirectory() as work_directory:
+        process, log_file = start_app(args, stub.url, work_directory)
+        try:
+            timeout = httpx.Timeout(300.0)
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.app_port}", timeout=timeout,
+                                         limits=limits) as client, \
+                    httpx.AsyncClient(base_url=stub.url) as stub_client:
+                await wait_until_ready(client, process)
+                for scenario in args.scenarios:
+                    results["scenarios"][scenario] = await run_scenario(client, stub_client, scenario, args)
+                results["app_stats"] = (await client.get("/stats")).json()
+        finally:
+            process.terminate()
+            process.wait()
+            log_file.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"{datetime.now():%Y%m%d-%H%M%S}_{results['commit']}.json")
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Resultados salvos em {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
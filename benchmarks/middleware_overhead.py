@@ -0,0 +1,131 @@
+"""
+Mede o custo por requisição do middleware de logging.
+
+Compara três versões de um app mínimo, todas recebendo o mesmo POST com corpo JSON:
+    - sem middleware (referência)
+    - middleware antigo (lê o corpo inteiro e grava no log com FileHandler síncrono)
+    - RequestLoggingMiddleware (amostragem do corpo + QueueHandler)
+
+Uso:
+    python benchmarks/middleware_overhead.py --requests 5000 --body-bytes 20000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI, Request
+
+from observability import RequestLoggingMiddleware
+
+
+def build_app(kind, log_file):
+    app = FastAPI()
+    logger = logging.getLogger(f"benchmark.{kind}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    @app.post("/echo")
+    async def echo(payload: list[dict]):
+        return {"count": len(payload)}
+
+    if kind == "legacy":
+        logger.addHandler(logging.FileHandler(log_file))
+
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            start_time = time.time()
+            logger.info(f"Requisição recebida: {request.method} {request.url}")
+            body = await request.body()
+            body_str = body.decode()
+            if len(body_str) > 0:
+                logger.info(f"Corpo da requisição: {body_str[:1000]}{'...' if len(body_str) > 1000 else ''}")
+            request._body = body
+            response = await call_next(request)
+            logger.info(f"Requisição processada em {time.time() - start_time:.2f}s com status {response.status_code}")
+            return response
+
+    elif kind == "queued":
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, logging.FileHandler(log_file))
+        listener.start()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        middleware_logger = logging.getLogger("observability")
+        middleware_logger.propagate = False
+        middleware_logger.handlers = logger.handlers
+        middleware_logger.setLevel(logging.INFO)
+        app.add_middleware(RequestLoggingMiddleware)
+        app.state.listener = listener
+
+    return app
+
+
+async def measure(app, payload, requests):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        # Aquecimento
+        for _ in range(50):
+            await client.post("/echo", content=payload, headers={"content-type": "application/json"})
+
+        durations = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.post("/echo", content=payload, headers={"content-type": "application/json"})
+            durations.append(time.perf_counter() - start)
+            response.raise_for_status()
+    return durations
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {
+        "mean_us": statistics.fmean(ordered) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p99_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--body-bytes", type=int, default=20000, help="tamanho aproximado do corpo enviado")
+    parser.add_argument("--output", help="arquivo JSON para salvar os resultados")
+    args = parser.parse_args()
+
+    message = "x" * 100
+    payload = json.dumps([{"message": message}] * max(1, args.body_bytes // (len(message) + 16))).encode()
+
+    results = {"requests": args.requests, "body_bytes": len(payload), "variants": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ("none", "legacy", "queued"):
+            app = build_app(kind, os.path.join(directory, f"{kind}.log"))
+            results["variants"][kind] = summarize(await measure(app, payload, args.requests))
+            if hasattr(app.state, "listener"):
+                app.state.listener.stop()
+
+    baseline = results["variants"]["none"]["mean_us"]
+    print(f"{'variante':<10} {'média (µs)':>12} {'p50 (µs)':>10} {'p99 (µs)':>10} {'overhead (µs)':>14}")
+    for kind, stats in results["variants"].items():
+        stats["overhead_us"] = stats["mean_us"] - baseline
+        print(
+            f"{kind:<10} {stats['mean_us']:>12.1f} {stats['p50_us']:>10.1f} "
+            f"{stats['p99_us']:>10.1f} {stats['overhead_us']:>14.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
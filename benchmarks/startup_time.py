@@ -0,0 +1,144 @@
+"""
+Mede o tempo de import e de startup da API (cold start), sem chamar os provedores reais.
+
+Para cada modo de aquecimento (STARTUP_WARMUP) e cada rodada, inicia `uvicorn main:app`
+em um processo novo com PROVIDER_TRANSPORT=fake e mede, a partir do spawn:
+    - quando /livez responde 200 (o servidor aceita conexões)
+    - quando /readyz responde 200 (aquecimento concluído)
+    - a latência da primeira requisição a /analyze
+Antes disso mede o tempo de `import main` e lista os imports diretos mais caros
+(saída de `python -X importtime`).
+
+Uso:
+    python benchmarks/startup_time.py --runs 5
+    python benchmarks/startup_time.py --modes background blocking --env SENTIMENT_BACKEND=local
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+
+def base_environment(args, extra=None):
+    environment = dict(os.environ, PYTHONPATH=ROOT, PROVIDER_TRANSPORT="fake", CACHE_BACKEND="none")
+    environment.update(dict(item.split("=", 1) for item in args.env))
+    environment.update(extra or {})
+    return environment
+
+
+def measure_imports(args, work_directory, top=10):
+    """Tempo total de `import main` e os imports diretos (de main) com maior tempo acumulado"""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=work_directory, env=base_environment(args), capture_output=True, text=True, check=True,
+    )
+    total = float(result.stdout.strip().splitlines()[-1])
+
+    # Linhas no formato "import time: self [us] | cumulative | nome", com o nível na indentação;
+    # os filhos aparecem antes do módulo que os importou
+    imports = []
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children.append((int(cumulative) / 1e6, name.strip()))
+        elif depth == 0:
+            if name.strip() == "main":
+                imports = children
+            children = []
+    return total, sorted(imports, reverse=True)[:top]
+
+
+async def measure_startup(args, mode, work_directory):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"],
+        cwd=work_directory,
+        env=base_environment(args, {"STARTUP_WARMUP": mode}),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    timings = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.app_port}", timeout=60.0) as client:
+            for path in ("/livez", "/readyz"):
+                while path not in timings:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"A API encerrou durante o startup (modo {mode})")
+                    if time.perf_counter() - start > args.timeout:
+                        raise RuntimeError(f"A API não respondeu {path} em {args.timeout}s (modo {mode})")
+                    try:
+                        if (await client.get(path)).status_code == 200:
+                            timings[path] = time.perf_counter() - start
+                            continue
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.01)
+
+            request_start = time.perf_counter()
+            response = await client.post("/analyze", json=[{"message": "Primeira mensagem depois do startup"}])
+            response.raise_for_status()
+            timings["first_request"] = time.perf_counter() - request_start
+            timings["warmup"] = (await client.get("/readyz")).json()
+    finally:
+        process.terminate()
+        process.wait()
+    return timings
+
+
+def median(values):
+    return statistics.median(values) * 1000 if values else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="processos iniciados por modo")
+    parser.add_argument("--modes", nargs="+", default=["background", "blocking"], choices=["background", "blocking"])
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="variável de ambiente extra para a API (pode repetir)")
+    parser.add_argument("--app-port", type=int, default=8091)
+    parser.add_argument("--timeout", type=float, default=120.0, help="segundos de espera por /readyz")
+    parser.add_argument("--output", help="arquivo JSON com as medições de cada rodada")
+    args = parser.parse_args()
+
+    results = {"config": {key: value for key, value in vars(args).items() if key != "output"}, "modes": {}}
+    with tempfile.TemporaryDirectory() as work_directory:
+        import_total, imports = measure_imports(args, work_directory)
+        results["import_seconds"] = import_total
+        results["slowest_imports"] = imports
+        print(f"import main: {import_total * 1000:.1f} ms; imports diretos mais caros:")
+        for seconds, name in imports:
+            print(f"  {name:<30} {seconds * 1000:>8.1f} ms")
+
+        for mode in args.modes:
+            results["modes"][mode] = [await measure_startup(args, mode, work_directory) for _ in range(args.runs)]
+
+    print(f"\n{'modo':<12} {'/livez (ms)':>12} {'/readyz (ms)':>13} {'1ª req. (ms)':>13}   (medianas de {args.runs})")
+    for mode, runs in results["modes"].items():
+        print(
+            f"{mode:<12} {median([run['/livez'] for run in runs]):>12.1f} "
+            f"{median([run['/readyz'] for run in runs]):>13.1f} "
+            f"{median([run['first_request'] for run in runs]):>13.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Resultados salvos em {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
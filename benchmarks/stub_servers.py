@@ -0,0 +1,184 @@
+"""
+Servidor local que imita as APIs do Gemini e da NLPCloud para benchmarks offline.
+
+Responde nas mesmas rotas usadas por clients.py (generateContent e sentiment), com
+latência, taxa de erros e limite de requisições por minuto configuráveis. Quando o
+limite é excedido, devolve 429 com Retry-After, como os provedores reais.
+
+Rotas de controle:
+    GET  /_stats  - contadores de chamadas recebidas, erros e 429 por provedor
+    POST /_reset  - zera os contadores
+
+Uso isolado (a aplicação deve apontar GEMINI_BASE_URL e NLPCLOUD_BASE_URL para ele):
+    python benchmarks/stub_servers.py --port 8100 --gemini-latency 0.8 --nlpcloud-latency 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from clients import _fake_generation
+
+
+class StubProvider:
+    """Comportamento configurável de um provedor falso (latência, erros e rate limit)"""
+
+    def __init__(self, name, latency=0.0, jitter=0.0, error_rate=0.0, requests_per_minute=0):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.window = []
+
+    def stats(self):
+        return {"calls": self.calls, "errors": self.errors, "rate_limited": self.rate_limited}
+
+    def retry_after(self):
+        """Segundos até liberar uma vaga na janela de um minuto, ou None se houver cota"""
+        if not self.requests_per_minute:
+            return None
+        now = time.monotonic()
+        self.window = [moment for moment in self.window if now - moment < 60]
+        if len(self.window) >= self.requests_per_minute:
+            return max(1, int(60 - (now - self.window[0])) + 1)
+        self.window.append(now)
+        return None
+
+    async def respond(self, build_response):
+        self.calls += 1
+        retry_after = self.retry_after()
+        if retry_after is not None:
+            self.rate_limited += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(retry_after)},
+                content={"error": {
+                    "code": 429,
+                    "status": "RESOURCE_EXHAUSTED",
+                    "details": [{
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{retry_after}s",
+                    }],
+                }},
+            )
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse(status_code=503, content={"error": f"Erro simulado em {self.name}"})
+        return build_response()
+
+
+def build_app(gemini, nlpcloud):
+    app = FastAPI()
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        payload = await request.json()
+        prompt = payload["contents"][0]["parts"][0]["text"]
+
+        def build_response():
+            text = _fake_generation(prompt, payload.get("generationConfig"))
+            return {
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+            }
+
+        return await gemini.respond(build_response)
+
+    async def sentiment(request: Request):
+        payload = await request.json()
+
+        def build_response():
+            digest = hashlib.sha256(payload.get("text", "").encode()).digest()
+            label = "POSITIVE" if digest[0] % 2 == 0 else "NEGATIVE"
+            return {"scored_labels": [{"label": label, "score": 0.5 + digest[1] / 512}]}
+
+        return await nlpcloud.respond(build_response)
+
+    app.add_api_route("/v1/gpu/{model}/sentiment", sentiment, methods=["POST"])
+    app.add_api_route("/v1/{model}/sentiment", sentiment, methods=["POST"])
+
+    @app.get("/_stats")
+    def stats():
+        return {"gemini": gemini.stats(), "nlpcloud": nlpcloud.stats()}
+
+    @app.post("/_reset")
+    def reset():
+        gemini.reset()
+        nlpcloud.reset()
+        return {"status": "ok"}
+
+    return app
+
+
+def add_arguments(parser):
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="latência média do Gemini (s)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rpm", type=int, default=0, help="limite por minuto do Gemini (0 = sem limite)")
+    parser.add_argument("--nlpcloud-latency", type=float, default=0.2, help="latência média da NLPCloud (s)")
+    parser.add_argument("--nlpcloud-error-rate", type=float, default=0.0)
+    parser.add_argument("--nlpcloud-rpm", type=int, default=0, help="limite por minuto da NLPCloud (0 = sem limite)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="variação da latência em fração da média")
+
+
+def app_from_arguments(args):
+    gemini = StubProvider(
+        "gemini", args.gemini_latency, args.gemini_latency * args.jitter, args.gemini_error_rate, args.gemini_rpm
+    )
+    nlpcloud = StubProvider(
+        "nlpcloud", args.nlpcloud_latency, args.nlpcloud_latency * args.jitter, args.nlpcloud_error_rate,
+        args.nlpcloud_rpm,
+    )
+    return build_app(gemini, nlpcloud)
+
+
+class StubServer:
+    """Roda o servidor falso com uvicorn em uma thread separada (usado por load_bench.py)"""
+
+    def __init__(self, app, host="127.0.0.1", port=8100):
+        import uvicorn
+
+        self.url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(app_from_arguments(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from metrics import cache_requests_total, cache_hit_ratio
+
+logger = logging.getLogger(__name__)
+
+# "memory" (padrão), "sqlite" (persiste entre reinícios) ou "none" (desativa o cache)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 24 * 60 * 60))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "data/cache.db")
+# No SQLite, a leitura só regrava accessed_at (usado no descarte) se ele tiver mais que isso
+CACHE_TOUCH_INTERVAL_SECONDS = float(os.getenv("CACHE_TOUCH_INTERVAL_SECONDS", 10 * 60))
+
+
+def normalize_message(message):
+    """Normaliza a mensagem para que variações triviais (espaços, composição unicode) gerem a mesma chave"""
+    return " ".join(unicodedata.normalize("NFC", message).split())
+
+
+def make_cache_key(kind, message, prompt_version, model):
+    """
+    Chave de conteúdo: hash da mensagem normalizada junto com o tipo de resultado,
+    a versão do template de prompt e o modelo. Trocar qualquer um deles invalida o cache.
+    """
+    raw = "\x1f".join([kind, prompt_version, model, normalize_message(message)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Interface comum dos backends de cache; os valores são sempre strings"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+            cache_requests_total.labels("miss").inc()
+        else:
+            self.hits += 1
+            cache_requests_total.labels("hit").inc()
+        return value
+
+    def get(self, key):
+        return self._count(self._get(key))
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    async def aget_many(self, keys):
+        """
+        Versão assíncrona de `get` para várias chaves, na mesma ordem (None para as ausentes).
+
+        O cache é só um atalho: se a leitura falhar (ex.: SQLite travado ou corrompido), as
+        chaves contam como ausentes e quem chamou segue para a geração.
+        """
+        try:
+            values = await self._get_many(keys)
+        except Exception as e:
+            logger.warning(f"Falha ao ler o cache ({type(self).__name__}), tratando como ausente: {e}")
+            values = [None] * len(keys)
+        return [self._count(value) for value in values]
+
+    async def aset_many(self, items):
+        """Versão assíncrona de `set` para vários pares `(chave, valor)`; falhas só são registradas"""
+        if not items:
+            return
+        try:
+            await self._set_many(items)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar {len(items)} entradas no cache ({type(self).__name__}): {e}")
+
+    async def _get_many(self, keys):
+        return [self._get(key) for key in keys]
+
+    async def _set_many(self, items):
+        for key, value in items:
+            self._set(key, value)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio(),
+        }
+
+
+class NullCache(ResultCache):
+    """Backend usado quando o cache está desativado"""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+
+class MemoryCache(ResultCache):
+    """
+    Cache LRU em memória com expiração por TTL.\n
+    Além do número máximo de entradas, limita o total de bytes armazenados e
+    descarta as entradas menos usadas recentemente quando algum limite é atingido.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.total_bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.debug("Valor maior que o limite do cache, ignorando")
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[2]
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, size)
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"bytes": self.total_bytes, "evictions": self.evictions})
+        return stats
+
+
+class SQLiteCache(ResultCache):
+    """
+    Cache em disco (SQLite) que sobrevive a reinícios do servidor.\n
+    Mantém a mesma política de TTL e descarta as entradas acessadas há mais tempo
+    quando o número máximo de entradas é ultrapassado. As versões assíncronas
+    (`aget_many`/`aset_many`) rodam em uma thread, para que a espera pelo lock do arquivo
+    não trave o event loop, e a leitura só regrava accessed_at de tempos em tempos.
+    """
+
+    def __init__(self, path=CACHE_SQLITE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+        self._entries = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        # Vários workers podem compartilhar o arquivo; o timeout cobre disputas pelo lock de escrita
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self._count_entries()
+        logger.info(f"Cache SQLite aberto em {path}")
+
+    def _count_entries(self):
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, accessed_at FROM results WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            # Uma escrita a cada leitura disputaria o lock do arquivo à toa: a ordem de descarte
+            # só precisa da precisão de CACHE_TOUCH_INTERVAL_SECONDS
+            if now - row[1] > CACHE_TOUCH_INTERVAL_SECONDS:
+                self._connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key, value):
+        self._write([(key, value)])
+
+    def _write(self, items):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, value, now + self.ttl_seconds, now) for key, value in items],
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            # Substituições também contam: o total exato é refeito a cada limpeza
+            self._entries += len(items)
+            # A limpeza percorre o índice, então é feita só a cada 100 escritas
+            previous = self._writes
+            self._writes += len(items)
+            if self._writes // 100 == previous // 100:
+                return
+            self._connection.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            self._connection.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._count_entries()
+
+    async def _get_many(self, keys):
+        return await asyncio.to_thread(lambda: [self._get(key) for key in keys])
+
+    async def _set_many(self, items):
+        await asyncio.to_thread(self._write, items)
+
+    def __len__(self):
+        # Contagem aproximada (refeita a cada limpeza): não consulta o arquivo a cada /stats
+        return self._entries
+
+
+def create_cache(backend=CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteCache()
+    if backend == "none":
+        return NullCache()
+    return MemoryCache()
+
+
+_cache = None
+
+
+def get_cache():
+    """Devolve o cache compartilhado do processo, criando-o na primeira chamada"""
+    global _cache
+    if _cache is None:
+        _cache = create_cache()
+        cache_hit_ratio.set_function(_cache.hit_ratio)
+        logger.info(f"Cache de resultados inicializado: {type(_cache).__name__}")
+    return _cache
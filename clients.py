@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Endpoints dos provedores (podem ser sobrescritos para apontar para servidores locais)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+NLPCLOUD_BASE_URL = os.getenv("NLPCLOUD_BASE_URL", "https://api.nlpcloud.io")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+NLPCLOUD_MODEL = os.getenv("NLPCLOUD_MODEL", "finetuned-llama-3-70b")
+NLPCLOUD_GPU = os.getenv("NLPCLOUD_GPU", "true").lower() in ("1", "true", "yes")
+
+# Configurações do pool de conexões HTTP compartilhado
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", 20))
+PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_MAX_KEEPALIVE_CONNECTIONS", 10))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", 30.0))
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", 5.0))
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", 60.0))
+PROVIDER_POOL_TIMEOUT = float(os.getenv("PROVIDER_POOL_TIMEOUT", 10.0))
+# Conexões abertas com cada provedor no aquecimento do startup (0 não abre nenhuma)
+PROVIDER_WARMUP_CONNECTIONS = int(os.getenv("PROVIDER_WARMUP_CONNECTIONS", 2))
+
+# "http" usa a rede normalmente; "fake" responde localmente sem sair da máquina
+PROVIDER_TRANSPORT = os.getenv("PROVIDER_TRANSPORT", "http")
+
+
+class GenerationResponse:
+    """Resposta do Gemini no formato usado pelo restante do código (atributo `.text`)"""
+    text: str
+    usage: dict
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage or {}
+
+
+def _fake_from_schema(schema):
+    """Monta um valor de exemplo que respeita o esquema de resposta pedido ao Gemini"""
+    schema_type = schema.get("type", "STRING").upper()
+    if schema_type == "OBJECT":
+        return {name: _fake_from_schema(child) for name, child in schema.get("properties", {}).items()}
+    if schema_type == "ARRAY":
+        return [_fake_from_schema(schema.get("items", {}))]
+    if schema_type in ("INTEGER", "NUMBER"):
+        return 0
+    if schema_type == "BOOLEAN":
+        return True
+    return "texto gerado pelo transporte falso"
+
+
+# Sem esquema de resposta (modo "separate") o modelo segue o exemplo do prompt e costuma
+# envolver o JSON em cercas de markdown; o transporte falso imita esse formato
+_FAKE_PROCESS_DESCRIPTION = {
+    "title": "Análise de Sentimentos gerada pelo transporte falso",
+    "summary": "texto gerado pelo transporte falso",
+    "steps": [{"step_title": "1. Pré-processamento", "step_content": "texto gerado pelo transporte falso"}],
+    "conclusion": "texto gerado pelo transporte falso",
+}
+_FAKE_POEM = {
+    "title": "Poema do transporte falso",
+    "style": "Livre",
+    "mood": "Neutro",
+    "lines": ["texto gerado pelo transporte falso"],
+}
+
+
+def _fake_generation(prompt, generation_config):
+    schema = (generation_config or {}).get("responseSchema")
+    if not schema:
+        value = _FAKE_POEM if "poema" in prompt else _FAKE_PROCESS_DESCRIPTION
+        return f"```json\n{json.dumps(value, ensure_ascii=False, indent=2)}\n```"
+
+    value = _fake_from_schema(schema)
+    if "results" in value:
+        # Pedidos em lote terminam com a lista JSON das mensagens; devolve um item por índice
+        try:
+            messages = json.loads(prompt[prompt.index("["):])
+            item = value["results"][0]
+            value["results"] = [dict(item, index=message["index"]) for message in messages]
+        except (ValueError, KeyError, TypeError):
+            pass
+    return json.dumps(value, ensure_ascii=False)
+
+
+def fake_transport():
+    """
+    Transporte HTTP que imita as respostas do Gemini e da NLPCloud sem acessar a rede.\n
+    As respostas são determinísticas para o mesmo conteúdo, o que facilita testes offline.
+    """
+    def handler(request: httpx.Request):
+        payload = json.loads(request.content or b"{}")
+        if request.url.path.endswith(":generateContent"):
+            prompt = payload["contents"][0]["parts"][0]["text"]
+            text = _fake_generation(prompt, payload.get("generationConfig"))
+            return httpx.Response(200, json={
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+            })
+        if request.url.path.endswith("/sentiment"):
+            digest = hashlib.sha256(payload.get("text", "").encode()).digest()
+            label = "POSITIVE" if digest[0] % 2 == 0 else "NEGATIVE"
+            return httpx.Response(200, json={"scored_labels": [{"label": label, "score": 0.5 + digest[1] / 512}]})
+        return httpx.Response(404, json={"error": f"Rota falsa desconhecida: {request.url.path}"})
+
+    return httpx.MockTransport(handler)
+
+
+class ProviderClients:
+    """
+    Clientes HTTP de longa duração para o Gemini e a NLPCloud.\n
+    Cada provedor tem um `httpx.AsyncClient` próprio com pool de conexões keep-alive,
+    de modo que o handshake TLS é feito uma vez e reaproveitado entre requisições.
+    """
+
+    def __init__(
+        self,
+        gemini_api_key,
+        nlpcloud_api_key,
+        transport=None,
+        max_connections=PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections=PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY,
+        connect_timeout=PROVIDER_CONNECT_TIMEOUT,
+        read_timeout=PROVIDER_READ_TIMEOUT,
+        pool_timeout=PROVIDER_POOL_TIMEOUT,
+    ):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+
+        self.gemini = httpx.AsyncClient(
+            base_url=GEMINI_BASE_URL,
+            headers={"x-goog-api-key": gemini_api_key} if gemini_api_key else {},
+            limits=limits,
+            timeout=timeout,
+            transport=transport,
+        )
+        self.nlpcloud = httpx.AsyncClient(
+            base_url=NLPCLOUD_BASE_URL,
+            # Sem chave o cabeçalho ficaria "Token " (valor inválido para o httpx)
+            headers={"Authorization": f"Token {nlpcloud_api_key}"} if nlpcloud_api_key else {},
+            limits=limits,
+            timeout=timeout,
+            transport=transport,
+        )
+
+    @classmethod
+    def from_env(cls):
+        transport = fake_transport() if PROVIDER_TRANSPORT == "fake" else None
+        if transport:
+            logger.warning("Usando transporte falso para os provedores: nenhuma chamada real será feita")
+        return cls(
+            os.getenv("GEMINI_API_KEY"),
+            os.getenv("NLPCLOUD_API_KEY"),
+            transport=transport,
+        )
+
+    async def generate(self, contents, model=GEMINI_MODEL, generation_config=None):
+        """Chama o endpoint generateContent do Gemini e devolve um GenerationResponse"""
+        body = {"contents": [{"role": "user", "parts": [{"text": contents}]}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+
+        response = await self.gemini.post(f"/v1beta/models/{model}:generateContent", json=body)
+        response.raise_for_status()
+        data = response.json()
+
+        candidates = data.get("candidates") or []
+        if not candidates:
+            raise ValueError(f"Resposta do Gemini sem candidatos: {data}")
+        parts = candidates[0].get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts)
+        return GenerationResponse(text, data.get("usageMetadata"))
+
+    async def sentiment(self, text, model=NLPCLOUD_MODEL):
+        """Chama o endpoint de sentimento da NLPCloud e devolve o JSON bruto da resposta"""
+        path = f"/v1/gpu/{model}/sentiment" if NLPCLOUD_GPU else f"/v1/{model}/sentiment"
+        response = await self.nlpcloud.post(path, json={"text": text})
+        response.raise_for_status()
+        return response.json()
+
+    async def warm_up(self, connections=PROVIDER_WARMUP_CONNECTIONS):
+        """
+        Abre `connections` conexões (DNS, TCP e TLS) com cada provedor e as deixa no pool.
+
+        Usa requisições HEAD simultâneas na raiz, que não gastam cota; o status da resposta
+        não importa. Devolve quantas conexões foram abertas por provedor.
+        """
+        async def open_connections(client):
+            responses = await asyncio.gather(
+                *(client.head("/") for _ in range(connections)), return_exceptions=True
+            )
+            failures = [response for response in responses if isinstance(response, Exception)]
+            if failures:
+                logger.warning(f"Falha ao pré-conectar em {client.base_url}: {failures[0]!r}")
+            return len(responses) - len(failures)
+
+        gemini, nlpcloud = await asyncio.gather(open_connections(self.gemini), open_connections(self.nlpcloud))
+        return {"gemini": gemini, "nlpcloud": nlpcloud}
+
+    async def aclose(self):
+        await self.gemini.aclose()
+        await self.nlpcloud.aclose()
+
+
+_clients = None
+
+
+def init_clients():
+    """Cria os clientes compartilhados (chamado no startup da aplicação)"""
+    global _clients
+    if _clients is None:
+        _clients = ProviderClients.from_env()
+        logger.info("Clientes dos provedores inicializados")
+    return _clients
+
+
+def get_clients():
+    """Devolve os clientes compartilhados, criando-os se o startup ainda não o fez"""
+    return _clients or init_clients()
+
+
+async def close_clients():
+    """Fecha os pools de conexão (chamado no shutdown da aplicação)"""
+    global _clients
+    if _clients is not None:
+        await _clients.aclose()
+        _clients = None
+        logger.info("Clientes dos provedores encerrados")
@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tempo máximo que uma requisição de análise espera por resultados; depois disso o que ficou
+# pronto é devolvido e o restante recebe os fallbacks
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", 120.0))
+# O cliente pode pedir outro prazo pelo cabeçalho (em segundos), limitado a REQUEST_TIMEOUT_MAX_SECONDS
+REQUEST_TIMEOUT_HEADER = os.getenv("REQUEST_TIMEOUT_HEADER", "X-Request-Timeout")
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", 300.0))
+# Parte do prazo reservada para montar e enviar a resposta com os fallbacks
+DEADLINE_RESPONSE_MARGIN_SECONDS = float(os.getenv("DEADLINE_RESPONSE_MARGIN_SECONDS", 0.25))
+
+
+class Deadline:
+    """Instante limite de uma requisição, medido no relógio monotônico"""
+    timeout: float
+    expires_at: float
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """O prazo da requisição acabou antes de a chamada começar"""
+
+
+class ClientDisconnected(Exception):
+    """O cliente encerrou a conexão antes da resposta ficar pronta"""
+
+
+# Prazo da requisição em andamento; definido no endpoint e herdado pelas tasks do pipeline.
+# Sem prazo (None), como nos workers de jobs, as chamadas usam apenas os próprios limites.
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def deadline_from_headers(headers):
+    """Cria o prazo da requisição a partir do cabeçalho configurado ou do padrão"""
+    timeout = REQUEST_TIMEOUT_SECONDS
+    header = headers.get(REQUEST_TIMEOUT_HEADER)
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            logger.warning(f"Valor inválido no cabeçalho {REQUEST_TIMEOUT_HEADER}: {header!r}")
+    return Deadline(min(max(timeout, 0.1), REQUEST_TIMEOUT_MAX_SECONDS))
+
+
+def time_left(limit=None, margin=0.0):
+    """
+    Segundos disponíveis para uma etapa: o menor entre `limit` e o que resta do prazo da
+    requisição (descontada a `margin`). Devolve None quando não há nenhum dos dois.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return limit
+    remaining = deadline.remaining() - margin
+    return remaining if limit is None else min(limit, remaining)
+
+
+def budget_exhausted():
+    deadline = current_deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+def check_deadline():
+    """Levanta DeadlineExceeded se o prazo da requisição já acabou (evita chamadas inúteis)"""
+    if budget_exhausted():
+        raise DeadlineExceeded("Prazo da requisição esgotado")
+
+
+async def wait_within(limit, coroutine_function, *args, **kwargs):
+    """
+    Executa `coroutine_function(*args, **kwargs)` por até `limit` segundos (None: sem limite
+    próprio) e até o fim do prazo da requisição. O prazo é relido toda vez que a espera se
+    esgota: se foi estendido nesse meio tempo (ex.: outra requisição se juntou à chamada em
+    SingleFlight), a espera continua; senão, a chamada é cancelada e levanta TimeoutError.
+    """
+    loop = asyncio.get_running_loop()
+    limit_at = None if limit is None else loop.time() + limit
+    work = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+    try:
+        while True:
+            timeout = time_left(None if limit_at is None else limit_at - loop.time())
+            if timeout is not None and timeout <= 0:
+                break
+            done, _ = await asyncio.wait({work}, timeout=timeout)
+            if done:
+                return work.result()
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    work.cancel()
+    await asyncio.gather(work, return_exceptions=True)
+    raise TimeoutError()
+
+
+async def cancel_on_disconnect(receive, coroutine):
+    """
+    Executa `coroutine` enquanto observa o canal ASGI da requisição.\n
+    Se o cliente desconectar antes do fim, o trabalho é cancelado (liberando cota do rate
+    limiter e vagas do pipeline) e ClientDisconnected é levantada. O corpo da requisição já
+    precisa ter sido lido: a partir daí a única mensagem esperada é "http.disconnect".
+    """
+    work = asyncio.ensure_future(coroutine)
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        done, _ = await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        watcher.cancel()
+        raise
+
+    watcher.cancel()
+    if work in done:
+        return work.result()
+
+    work.cancel()
+    await asyncio.gather(work, return_exceptions=True)
+    raise ClientDisconnected()
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "data/jobs.db")
+# Tempo sem sinal de vida após o qual um job "running" volta para a fila (worker morreu)
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", 300))
+# Número de vezes que um job pode ser retomado antes de ser marcado como falho
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", 3))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class Job:
+    """Job reservado por um worker: apenas as mensagens que ainda não têm resultado"""
+    job_id: str
+    messages: list[str]
+    pending_indexes: list[int]
+
+    def __init__(self, job_id, messages, pending_indexes):
+        self.job_id = job_id
+        self.messages = messages
+        self.pending_indexes = pending_indexes
+
+
+class JobQueue:
+    """
+    Fila de jobs de análise persistida em SQLite, compartilhada entre a API e os workers.\n
+    A API apenas insere jobs e lê resultados; os workers reservam jobs com um lease que
+    é renovado a cada mensagem concluída. Se um worker morrer, o lease expira e outro
+    worker retoma o job a partir das mensagens que ainda não têm resultado.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, messages TEXT NOT NULL, total INTEGER NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            "job_id TEXT NOT NULL, idx INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, idx))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def submit(self, messages):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, status, messages, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, json.dumps(messages), len(messages), now, now),
+            )
+        logger.info(f"Job {job_id} enfileirado com {len(messages)} mensagens")
+        return job_id
+
+    def claim(self):
+        """Reserva o job mais antigo disponível (na fila ou com lease expirado), ou devolve None"""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT id, messages, attempts FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED, STATUS_RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._connection.execute("COMMIT")
+                    return None
+
+                job_id, messages, attempts = row
+                if attempts >= JOBS_MAX_ATTEMPTS:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (STATUS_FAILED, "Número máximo de tentativas atingido", now, job_id),
+                    )
+                    self._connection.execute("COMMIT")
+                    logger.error(f"Job {job_id} descartado após {attempts} tentativas")
+                    return None
+
+                self._connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_RUNNING, now + JOBS_LEASE_SECONDS, now, job_id),
+                )
+                done = {
+                    index for (index,) in self._connection.execute(
+                        "SELECT idx FROM job_results WHERE job_id = ?", (job_id,)
+                    )
+                }
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        messages = json.loads(messages)
+        pending_indexes = [index for index in range(len(messages)) if index not in done]
+        return Job(job_id, messages, pending_indexes)
+
+    def save_result(self, job_id, index, result):
+        """Grava o resultado de uma mensagem e renova o lease do job"""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, idx, result) VALUES (?, ?, ?)",
+                (job_id, index, json.dumps(result)),
+            )
+            self._connection.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + JOBS_LEASE_SECONDS, now, job_id),
+            )
+
+    def complete(self, job_id):
+        self._set_status(job_id, STATUS_DONE)
+        logger.info(f"Job {job_id} concluído")
+
+    def fail(self, job_id, error):
+        self._set_status(job_id, STATUS_FAILED, error)
+        logger.error(f"Job {job_id} falhou: {error}")
+
+    def _set_status(self, job_id, status, error=None):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        """
+        Estado do job com os resultados parciais (None nas posições ainda pendentes).\n
+        Quando o job termina, inclui também `analysis` no mesmo formato de POST /analyze.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, total, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            result_rows = self._connection.execute(
+                "SELECT idx, result FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchall()
+
+        status, total, error, created_at, updated_at = row
+        results = [None] * total
+        for index, result in result_rows:
+            results[index] = json.loads(result)
+
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "completed": len(result_rows),
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "results": results,
+        }
+        if status == STATUS_DONE:
+            job["analysis"] = {
+                "process_description": [result["process_description"] for result in results],
+                "poem": [result["poem"] for result in results],
+                "message_list": [result["message_evaluation"] for result in results],
+            }
+        return job
+
+
+_queue = None
+
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -1,28 +1,56 @@
-from fastapi import FastAPI, Request, status
+from os.path import join, dirname
+from dotenv import load_dotenv
+
+# O .env é carregado uma única vez, aqui no ponto de entrada, antes dos módulos que leem
+# a configuração ao serem importados
+load_dotenv(join(dirname(__file__), '.env'))
+
+from fastapi import FastAPI, Request, Body, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, Response
 from fastapi.exceptions import RequestValidationError
 from models.analysis_request import AnalysisRequest
-from pydantic import BaseModel
+from models.responses import AnalyzeResponse
+from pipeline import default_pipeline, gemini_flights
+from clients import init_clients, close_clients, PROVIDER_CONNECT_TIMEOUT
+from cache import get_cache
+from services import gemini_rate_limiter, sentiment_flights, get_sentiment_batcher
+from rate_limiter import current_client_id
+from jobs import get_job_queue
+from observability import setup_logging, RequestLoggingMiddleware, LOG_BODY_MAX_BYTES
+from admission import (
+    AdmissionMiddleware, admission_controller, client_identity as scope_client_identity,
+    ADMISSION_MAX_MESSAGES, ADMISSION_MAX_MESSAGE_CHARS,
+)
+from sentiment_backends import get_sentiment_backend
+from warmup import startup_warmup
+from resilience import gemini_breaker, nlpcloud_breaker
+from deadline import (
+    current_deadline, deadline_from_headers, cancel_on_disconnect, time_left, ClientDisconnected,
+    DEADLINE_RESPONSE_MARGIN_SECONDS, REQUEST_TIMEOUT_HEADER,
+)
+from metrics import registry, analyze_request_seconds, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import asyncio
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
+from typing import Annotated
 import logging
 import time
 import os
 import traceback
 import json
 
-# Configuração do sistema de logging
+try:
+    import orjson
+except ImportError:  # orjson é opcional: sem ele as respostas usam o json da biblioteca padrão
+    orjson = None
+
+# Respostas JSON serializadas com orjson quando disponível (mais rápido e sem escapes \uXXXX)
+DefaultJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+# Configuração do sistema de logging (escrita em disco feita fora do caminho das requisições)
 log_directory = "logs"
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(f"{log_directory}/app.log"),
-        logging.StreamHandler(),  # Redireciona as mensagens para o console
-    ],
-)
+setup_logging(f"{log_directory}/app.log")
 
 logger = logging.getLogger(__name__)
 logger.info("Iniciando aplicação de análise de sentimentos")
@@ -39,11 +67,41 @@ class Message(BaseModel):
             {"message": "Terceira mensagem"},
         ]
     ```
+    Cada mensagem tem no máximo ADMISSION_MAX_MESSAGE_CHARS caracteres.
     """
-    message: str
+    message: str = Field(max_length=ADMISSION_MAX_MESSAGE_CHARS)
+
+
+# Corpo das rotas de análise: no máximo ADMISSION_MAX_MESSAGES mensagens por requisição
+MessageList = Annotated[list[Message], Body(max_length=ADMISSION_MAX_MESSAGES)]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Os clientes dos provedores são criados uma única vez e reaproveitados entre requisições
+    clients = init_clients()
+    get_cache()
+    # O trabalho pesado do startup vira etapas de aquecimento: por padrão rodam em segundo
+    # plano e o servidor já responde /livez; /readyz só responde 200 quando terminarem.
+    # O modelo local de sentimento (se configurado, com os imports do torch) é carregado uma única vez
+    startup_warmup.add("sentiment_backend", lambda: asyncio.to_thread(get_sentiment_backend().load))
+    # Análises pré-computadas (se o arquivo existir) ficam em memória para consulta O(1)
+    startup_warmup.add("precomputed", lambda: asyncio.to_thread(default_pipeline.precomputed.load))
+    # Conexões TLS com os provedores já abertas no pool quando chegar a primeira requisição
+    startup_warmup.add(
+        "provider_connections", clients.warm_up, required=False, timeout=2 * PROVIDER_CONNECT_TIMEOUT
+    )
+    await startup_warmup.start()
+    yield
+    await startup_warmup.stop()
+    await close_clients()
+
 
+app = FastAPI(lifespan=lifespan, default_response_class=DefaultJSONResponse)
 
-app = FastAPI()
+# Controle de admissão (tamanho do corpo, vagas de análise e limite por cliente). Fica por
+# dentro do CORS para que as respostas 413/429/503 também levem os cabeçalhos CORS.
+app.add_middleware(AdmissionMiddleware)
 
 # Lista expandida de origens permitidas
 origins = [
@@ -58,7 +116,7 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=False,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+    allow_headers=["Content-Type", "Authorization", "X-Requested-With", REQUEST_TIMEOUT_HEADER],
     expose_headers=["Content-Type"],
     max_age=86400,  # Cache por 24 horas para reduzir preflight requests
 )
@@ -66,17 +124,41 @@ app.add_middleware(
 logger.info(f"Middleware CORS configurado para origens: {origins}")
 
 
+# Erros de validação devolvidos e registrados por requisição; valores do contexto são cortados
+VALIDATION_MAX_ERRORS = 20
+VALIDATION_MAX_CONTEXT_CHARS = 100
+
+
+def summarize_validation_errors(errors):
+    """
+    Erros de validação sem o valor recebido (`input`), que pode ser uma mensagem inteira ou
+    o corpo todo, e com o contexto (`ctx`) convertido em texto curto.
+    """
+    summary = []
+    for error in errors[:VALIDATION_MAX_ERRORS]:
+        item = {key: value for key, value in error.items() if key not in ("input", "ctx", "url")}
+        if error.get("ctx"):
+            item["ctx"] = {
+                key: value if isinstance(value, (int, float)) else str(value)[:VALIDATION_MAX_CONTEXT_CHARS]
+                for key, value in error["ctx"].items()
+            }
+        summary.append(item)
+    if len(errors) > VALIDATION_MAX_ERRORS:
+        summary.append({"msg": f"Mais {len(errors) - VALIDATION_MAX_ERRORS} erros omitidos"})
+    return summary
+
+
 # Handler para erros de validação de requisição
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    error_detail = exc.errors()
+    error_detail = summarize_validation_errors(exc.errors())
     logger.error(f"Erro de validação de requisição: {error_detail}")
 
-    # Log do corpo da requisição para diagnóstico
+    # Log do corpo da requisição para diagnóstico (limitado para não copiar payloads enormes)
     body = await request.body()
     try:
-        body_str = body.decode()
-        logger.error(f"Corpo da requisição com erro: {body_str}")
+        body_str = body[:LOG_BODY_MAX_BYTES].decode(errors="replace")
+        logger.error(f"Corpo da requisição com erro: {body_str}{'...' if len(body) > LOG_BODY_MAX_BYTES else ''}")
     except:
         logger.error(f"Não foi possível decodificar o corpo da requisição")
 
@@ -89,58 +171,89 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
-# Middleware para logging de todas as requisições
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
+# Middleware para logging de todas as requisições (corpo registrado só por amostragem)
+app.add_middleware(RequestLoggingMiddleware)
 
-    # Log da requisição recebida
-    logger.info(f"Requisição recebida: {request.method} {request.url}")
 
-    # Tenta ler e registrar o corpo da requisição
-    try:
-        body = await request.body()
-        body_str = body.decode()
-        if len(body_str) > 0:
-            logger.info(
-                f"Corpo da requisição: {body_str[:1000]}{'...' if len(body_str) > 1000 else ''}"
-            )
+# Liveness: o processo está de pé e o event loop responde (não depende do aquecimento)
+@app.get("/livez")
+async def liveness_check():
+    return {"status": "alive"}
 
-        # Precisa reconstruir o corpo da requisição para uso posterior
-        request._body = body
-    except Exception as e:
-        logger.error(f"Erro ao ler corpo da requisição: {str(e)}")
 
-    # Processa a requisição
-    response = await call_next(request)
-
-    # Log da resposta
-    process_time = time.time() - start_time
-    logger.info(
-        f"Requisição processada em {process_time:.2f}s com status {response.status_code}"
-    )
+# Readiness: 503 enquanto o aquecimento do startup não terminou (ou se uma etapa obrigatória falhou)
+@app.get("/readyz")
+async def readiness_check():
+    warmup = startup_warmup.stats()
+    status_code = status.HTTP_200_OK if startup_warmup.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=status_code, content=warmup)
 
-    return response
 
-
-# Endpoint simples para verificar se o servidor está funcionando
+# Visão geral da saúde do servidor: aquecimento, backend, circuit breakers e ocupação.
+# Sempre responde 200 enquanto o processo está vivo; para roteamento use /readyz.
 @app.get("/health")
-def health_check():
+async def health_check():
     logger.info("Verificação de saúde realizada")
+    admission = admission_controller.stats()
     return {
         "status": "online",
         "message": "API de análise de sentimentos está operacional",
+        "ready": startup_warmup.ready,
+        "startup": startup_warmup.stats(),
+        "sentiment_backend": get_sentiment_backend().name,
+        "generation_mode": default_pipeline.generation_mode,
+        "circuit_breakers": {
+            "gemini": gemini_breaker.state,
+            "nlpcloud": nlpcloud_breaker.state,
+        },
+        "admission": {"in_flight": admission["in_flight"], "queue_depth": admission["queue_depth"]},
     }
 
 
-@app.post("/analyze")
-async def analyze_sentiment(message_list: list[Message]):
+# Estatísticas internas (cache de resultados, rate limiter, circuit breakers, chamadas coalescidas, lotes e admissão).
+# As rotas de diagnóstico são async: leem estado do event loop e não podem rodar no threadpool.
+@app.get("/stats")
+async def stats():
+    return {
+        "cache": get_cache().stats(),
+        "precomputed": default_pipeline.precomputed.stats(),
+        "gemini_rate_limiter": gemini_rate_limiter.stats(),
+        "circuit_breakers": {
+            "gemini": gemini_breaker.stats(),
+            "nlpcloud": nlpcloud_breaker.stats(),
+        },
+        "singleflight": {
+            "sentiment": sentiment_flights.stats(),
+            "gemini": gemini_flights.stats(),
+        },
+        "admission": admission_controller.stats(),
+        "batching": {
+            "sentiment": get_sentiment_batcher().stats(),
+            "gemini": default_pipeline.gemini_batcher.stats(),
+        },
+    }
+
+
+# Métricas no formato texto do Prometheus (latências por etapa, cache, rate limiter e gauges)
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def client_identity(request: Request):
+    """Identifica o cliente para a fila justa do rate limiter (IP visto pelo proxy confiável, se houver)"""
+    return scope_client_identity(request.scope)
+
+
+@app.post("/analyze", response_model=AnalyzeResponse)
+async def analyze_sentiment(message_list: MessageList, request: Request):
     """
     Recebe requisições de análise de sentimento do front-end 
     Loga informações relacionadas ao processamento da requisição
-    Retorna o resultado da análise em formato de dicionário, que depois é convertido para JSON.
+    Retorna o resultado da análise como JSON, com a descrição do processo e o poema já como
+    objetos (validados no servidor, ver parsing.py) em vez de strings com JSON dentro.
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     logger.info(
         f"Nova requisição de análise recebida com {len(message_list)} mensagens"
     )
@@ -149,14 +262,22 @@ async def analyze_sentiment(message_list: list[Message]):
         message_texts = [message.message for message in message_list]
         logger.debug(f"Mensagens para análise: {message_texts}")
 
-        analysis = AnalysisRequest(message_texts)
-        result = {"analysis": analysis.dict()}
-
-        end_time = time.time()
-        logger.info(
-            f"Análise concluída com sucesso em {end_time - start_time:.2f} segundos"
-        )
-        return result
+        # As chamadas ao Gemini desta requisição entram na fila justa com a identidade do cliente
+        # e respeitam o prazo da requisição (cabeçalho X-Request-Timeout ou o padrão)
+        current_client_id.set(client_identity(request))
+        current_deadline.set(deadline_from_headers(request.headers))
+        analysis = await cancel_on_disconnect(request.receive, AnalysisRequest.create(message_texts))
+        # Os objetos já foram validados no pipeline: a resposta é serializada direto, sem
+        # passar de novo pelo response_model (que fica só para a documentação da API)
+        response = DefaultJSONResponse({"analysis": analysis.dict()})
+
+        duration = time.perf_counter() - start_time
+        analyze_request_seconds.labels("/analyze").observe(duration)
+        logger.debug(f"Análise concluída com sucesso em {duration:.2f} segundos")
+        return response
+    except ClientDisconnected:
+        logger.info("Cliente desconectou antes do fim da análise; trabalho pendente cancelado")
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Erro durante a análise: {str(e)}")
         logger.error(traceback.format_exc())
@@ -169,6 +290,108 @@ async def analyze_sentiment(message_list: list[Message]):
         )
 
 
+def format_stream_event(event, stream_format):
+    """Serializa um evento como linha NDJSON ou como evento SSE"""
+    data = orjson.dumps(event).decode() if orjson is not None else json.dumps(event, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.post("/analyze/stream")
+async def analyze_sentiment_stream(message_list: MessageList, request: Request, format: str = "ndjson"):
+    """
+    Variante de /analyze que envia cada parte do resultado assim que fica pronta.\n
+    Cada evento tem `index` (posição da mensagem), `type` ("message_evaluation",
+    "process_description" ou "poem") e `data`. O último evento tem `type` "done".
+    Use `?format=sse` para Server-Sent Events; o padrão é NDJSON (um JSON por linha).
+    Se o prazo da requisição acabar, as partes que faltam são enviadas com os fallbacks e o
+    evento "done" traz `timed_out: true`. Se o cliente desconectar, o trabalho é cancelado.
+    """
+    stream_format = "sse" if format == "sse" else "ndjson"
+    message_texts = [message.message for message in message_list]
+    client_id = client_identity(request)
+    deadline = deadline_from_headers(request.headers)
+    logger.info(f"Nova requisição de análise em streaming com {len(message_texts)} mensagens ({stream_format})")
+
+    def part_event(index, kind, value):
+        data = value.dict() if kind == "message_evaluation" else value
+        return format_stream_event({"index": index, "type": kind, "data": data}, stream_format)
+
+    async def events():
+        start_time = time.perf_counter()
+        current_client_id.set(client_id)
+        current_deadline.set(deadline)
+        received = [{} for _ in message_texts]
+        timed_out = False
+        # O StreamingResponse cancela este gerador quando o cliente desconecta
+        parts = default_pipeline.stream_parts(message_texts)
+        try:
+            while True:
+                try:
+                    index, kind, value = await asyncio.wait_for(
+                        anext(parts), time_left(margin=DEADLINE_RESPONSE_MARGIN_SECONDS)
+                    )
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    timed_out = True
+                    break
+                received[index][kind] = value
+                yield part_event(index, kind, value)
+
+            if timed_out:
+                logger.warning("Prazo da requisição em streaming esgotado; enviando fallbacks para o restante")
+                for index, message in enumerate(message_texts):
+                    fallback = default_pipeline.partial_result(message, received[index]).dict()
+                    for kind in ("message_evaluation", "process_description", "poem"):
+                        if kind not in received[index]:
+                            yield format_stream_event(
+                                {"index": index, "type": kind, "data": fallback[kind]}, stream_format
+                            )
+            yield format_stream_event(
+                {"type": "done", "total": len(message_texts), "timed_out": timed_out}, stream_format
+            )
+            duration = time.perf_counter() - start_time
+            analyze_request_seconds.labels("/analyze/stream").observe(duration)
+            logger.debug(f"Análise em streaming concluída em {duration:.2f} segundos")
+        except Exception as e:
+            logger.error(f"Erro durante a análise em streaming: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield format_stream_event(
+                {"type": "error", "error": str(e), "message": "Ocorreu um erro ao processar sua solicitação"},
+                stream_format,
+            )
+        finally:
+            await parts.aclose()
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(message_list: MessageList):
+    """
+    Enfileira a análise para processamento em segundo plano pelos workers (worker.py).
+    Retorna imediatamente o identificador do job, que deve ser consultado em GET /jobs/{job_id}.
+    """
+    message_texts = [message.message for message in message_list]
+    job_id = await asyncio.to_thread(get_job_queue().submit, message_texts)
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Retorna o estado do job com os resultados parciais e, ao final, a análise completa"""
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": f"Job {job_id} não encontrado"},
+        )
+    return job
+
+
 # Endpoint para debug - mostra exatamente o que foi recebido
 @app.post("/debug")
 async def debug_request(request: Request):
@@ -0,0 +1,338 @@
+import bisect
+import math
+import threading
+
+# Limites padrão dos histogramas de latência, em segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Shards:
+    """
+    Valores acumulados por thread, somados só na hora da coleta.\n
+    Cada thread escreve na sua própria lista, então registrar uma medida não disputa
+    lock nenhum; o lock só é usado quando uma thread nova cria seu shard e na coleta.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = [0.0] * self.size
+            with self._lock:
+                self._shards.append(shard)
+            self._local.values = shard
+        return shard
+
+    def totals(self):
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0.0] * self.size
+        for shard in shards:
+            for index, value in enumerate(shard):
+                totals[index] += value
+        return totals
+
+
+class _Metric:
+    """Base das métricas: guarda os filhos por combinação de valores de labels"""
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        if not self.labelnames:
+            return [((), self._default)]
+        return sorted(self._children.items())
+
+    def _format_labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in self._items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.get()[0] += amount
+
+    def value(self):
+        return self._shards.totals()[0]
+
+
+class Counter(_Metric):
+    """Contador monotônico (ex.: total de tentativas repetidas)"""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._format_labels(values)} {_format_value(child.value())}"]
+
+
+class _GaugeChild:
+    __slots__ = ("_shards", "_function")
+
+    def __init__(self):
+        self._shards = _Shards(1)
+        self._function = None
+
+    def inc(self, amount=1):
+        self._shards.get()[0] += amount
+
+    def dec(self, amount=1):
+        self._shards.get()[0] -= amount
+
+    def set_function(self, function):
+        """Usa `function()` como valor na coleta (ex.: profundidade atual de uma fila)"""
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._shards.totals()[0]
+
+
+class Gauge(_Metric):
+    """Valor que sobe e desce (ex.: requisições em andamento)"""
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+    def track_inprogress(self):
+        return _InProgress(self._default)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._format_labels(values)} {_format_value(child.value())}"]
+
+
+class _InProgress:
+    """Context manager que incrementa o gauge na entrada e decrementa na saída"""
+    __slots__ = ("_child",)
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._child.inc()
+
+    def __exit__(self, *exc):
+        self._child.dec()
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_shards")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # Contagem por faixa (não cumulativa), mais soma e total no fim
+        self._shards = _Shards(len(buckets) + 3)
+
+    def observe(self, value):
+        shard = self._shards.get()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def snapshot(self):
+        totals = self._shards.totals()
+        cumulative = []
+        running = 0.0
+        for count in totals[:len(self._buckets) + 1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-2], totals[-1]
+
+
+class Histogram(_Metric):
+    """Histograma de valores (ex.: latências em segundos) com faixas fixas"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        cumulative, total, count = child.snapshot()
+        lines = []
+        for bound, bucket_count in zip(self.buckets + (math.inf,), cumulative):
+            labels = self._format_labels(values, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {_format_value(bucket_count)}")
+        labels = self._format_labels(values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {_format_value(count)}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """Conjunto de métricas do processo, exportado no formato texto do Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+
+# Métricas da aplicação; os módulos importam daqui e registram as medidas nos pontos de chamada
+gemini_request_seconds = registry.histogram(
+    "gemini_request_seconds", "Latência de cada chamada ao Gemini, por tipo de prompt e resultado",
+    ("kind", "outcome"),
+)
+gemini_retries_total = registry.counter(
+    "gemini_retries_total", "Tentativas repetidas de chamadas ao Gemini, por tipo de prompt e motivo",
+    ("kind", "reason"),
+)
+gemini_tokens_total = registry.counter(
+    "gemini_tokens_total", "Tokens consumidos no Gemini segundo o usageMetadata, por tipo de prompt e direção",
+    ("kind", "direction"),
+)
+prompt_truncations_total = registry.counter(
+    "prompt_truncations_total", "Mensagens cortadas para caber no orçamento de tokens do prompt", ("kind",),
+)
+nlpcloud_request_seconds = registry.histogram(
+    "nlpcloud_request_seconds", "Latência de cada chamada de sentimento à NLPCloud, por resultado", ("outcome",),
+)
+sentiment_batch_seconds = registry.histogram(
+    "sentiment_batch_seconds", "Latência de cada lote de análise de sentimento, por backend", ("backend",),
+)
+rate_limiter_wait_seconds = registry.histogram(
+    "rate_limiter_wait_seconds", "Tempo de espera por cota no escalonador de rate limiting", ("limiter",),
+)
+rate_limiter_queue_depth = registry.gauge(
+    "rate_limiter_queue_depth", "Chamadas aguardando cota no escalonador de rate limiting", ("limiter",),
+)
+cache_requests_total = registry.counter(
+    "cache_requests_total", "Consultas ao cache de resultados, por resultado (hit ou miss)", ("result",),
+)
+cache_hit_ratio = registry.gauge("cache_hit_ratio", "Fração das consultas ao cache que foram acertos")
+analyze_request_seconds = registry.histogram(
+    "analyze_request_seconds", "Tempo total de processamento das requisições de análise, por endpoint",
+    ("endpoint",),
+)
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "Requisições HTTP em andamento")
+app_ready = registry.gauge("app_ready", "1 quando o aquecimento do startup terminou e a aplicação está pronta")
+provider_calls_in_flight = registry.gauge(
+    "provider_calls_in_flight", "Requisições HTTP ao Gemini em andamento no pipeline de análise",
+)
+circuit_state = registry.gauge(
+    "circuit_state", "Estado do circuit breaker por provedor (0 fechado, 1 meio-aberto, 2 aberto)", ("provider",),
+)
+circuit_rejections_total = registry.counter(
+    "circuit_rejections_total", "Chamadas recusadas na hora porque o circuito do provedor estava aberto",
+    ("provider",),
+)
+hedged_requests_total = registry.counter(
+    "hedged_requests_total", "Tentativas paralelas (hedging) disparadas e quantas responderam primeiro",
+    ("provider", "event"),
+)
+precomputed_lookups_total = registry.counter(
+    "precomputed_lookups_total", "Consultas às análises pré-computadas, por resultado (hit ou miss)", ("result",),
+)
+microbatch_size = registry.histogram(
+    "microbatch_size", "Itens por lote enviado pelos agrupadores de requisições simultâneas", ("batcher",),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+admission_rejections_total = registry.counter(
+    "admission_rejections_total", "Requisições recusadas pelo controle de admissão, por motivo", ("reason",),
+)
+admission_queue_depth = registry.gauge(
+    "admission_queue_depth", "Requisições de análise aguardando vaga no controle de admissão",
+)
+singleflight_in_flight = registry.gauge(
+    "singleflight_in_flight", "Chamadas distintas em andamento que podem ser compartilhadas", ("group",),
+)
@@ -1,31 +1,78 @@
-from services import analyze_phrase
+from services import analyze_phrases
+from sentiment_backends import get_sentiment_backend
+from cache import get_cache, make_cache_key
+import json
 import logging
-import time
 
 logger = logging.getLogger(__name__)
 
+# Versão do formato da avaliação guardada no cache; incremente ao mudar a interpretação da resposta
+SENTIMENT_VERSION = "sentiment-v1"
+
 class MessageEvaluation:
     message_text: str
     label: str
     score: float
-    
-    def __init__(self, message_text):
-        logger.info(f"Avaliando mensagem: '{message_text[:30]}...' ({len(message_text)} caracteres)")
-        start_time = time.time()
-        
+
+    def __init__(self, message_text, evaluation):
+        """
+        Monta a avaliação a partir da resposta já obtida de analyze_phrases.
+        Para avaliar mensagens do zero use `await MessageEvaluation.create_many(textos)`.
+        """
         self.message_text = message_text
         try:
-            evaluation = analyze_phrase(message_text)
             self.label = evaluation[0]['label']
             self.score = evaluation[0]['score']
-            logger.info(f"Resultado da avaliação: {self.label} (score: {self.score})")
+            logger.debug(f"Resultado da avaliação: {self.label} (score: {self.score})")
         except Exception as e:
             logger.error(f"Erro ao avaliar mensagem: {str(e)}")
             self.label = "ERROR"
             self.score = 0.0
-            
-        logger.info(f"Avaliação concluída em {time.time() - start_time:.2f} segundos")
-        
+
+    @classmethod
+    def unavailable(cls, message_text):
+        """
+        Avaliação de fallback para quando o sentimento não ficou pronto a tempo.
+
+        O prazo esgotado é esperado e já registrado por quem chama, então não é logado como erro.
+        """
+        logger.debug(f"Avaliação indisponível para a mensagem: '{message_text[:30]}...'")
+        return cls(message_text, [{"label": "ERROR", "score": 0.0}])
+
+    @classmethod
+    async def create_many(cls, message_texts):
+        """
+        Avalia várias mensagens com uma única chamada em lote ao backend de sentimento
+        (apenas as que não estão no cache). A ordem de `message_texts` é preservada.
+        """
+        cache = get_cache()
+        cache_keys = [cls.cache_key(message_text) for message_text in message_texts]
+        evaluations = [None] * len(message_texts)
+        pending = []
+        for index, cached in enumerate(await cache.aget_many(cache_keys)):
+            if cached is not None:
+                evaluations[index] = cls(message_texts[index], json.loads(cached))
+            else:
+                pending.append(index)
+
+        if pending:
+            responses = await analyze_phrases([message_texts[index] for index in pending])
+            entries = []
+            for index, evaluation in zip(pending, responses):
+                evaluations[index] = cls(message_texts[index], evaluation)
+                # Só resultados válidos vão para o cache; erros devem ser tentados de novo na próxima vez
+                if evaluations[index].label not in ("ERROR", "UNDEFINED"):
+                    entries.append((cache_keys[index], json.dumps(evaluation)))
+            await cache.aset_many(entries)
+
+        logger.info(f"{len(message_texts)} mensagens avaliadas ({len(message_texts) - len(pending)} do cache)")
+        return evaluations
+
+    @staticmethod
+    def cache_key(message_text):
+        backend = get_sentiment_backend()
+        return make_cache_key("sentiment", message_text, SENTIMENT_VERSION, f"{backend.name}:{backend.model}")
+
     def dict(self):
         return {
             "message_text": self.message_text,
@@ -0,0 +1,45 @@
+from pydantic import BaseModel, ConfigDict
+
+
+class _ResponseModel(BaseModel):
+    # Espaços e quebras de linha sobrando nas pontas dos textos gerados são descartados
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+
+class ProcessStep(_ResponseModel):
+    step_title: str
+    step_content: str
+
+
+class ProcessDescription(_ResponseModel):
+    """Descrição do processo de análise de sentimentos gerada pelo Gemini"""
+    title: str
+    summary: str
+    steps: list[ProcessStep]
+    conclusion: str
+
+
+class Poem(_ResponseModel):
+    """Poema gerado pelo Gemini a partir da mensagem"""
+    title: str
+    style: str
+    mood: str
+    lines: list[str]
+
+
+class MessageEvaluationResult(BaseModel):
+    message_text: str
+    label: str
+    score: float
+
+
+class AnalysisResult(BaseModel):
+    """Listas paralelas, na ordem das mensagens recebidas"""
+    process_description: list[ProcessDescription]
+    poem: list[Poem]
+    message_list: list[MessageEvaluationResult]
+
+
+class AnalyzeResponse(BaseModel):
+    """Corpo da resposta de /analyze: objetos já decodificados, sem JSON dentro de strings"""
+    analysis: AnalysisResult
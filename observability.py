@@ -0,0 +1,110 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+from metrics import http_requests_in_flight
+
+logger = logging.getLogger(__name__)
+
+# Fração das requisições que têm o corpo registrado no log (0.0 desativa, 1.0 registra todas)
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", 0.01))
+# Máximo de bytes do corpo copiados para o log em cada requisição amostrada
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", 1000))
+
+# O PID distingue as linhas dos vários workers que escrevem no mesmo arquivo
+LOG_FORMAT = "%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s"
+
+
+def setup_logging(log_file, level=logging.INFO):
+    """
+    Configura o logging da aplicação sem escrita síncrona em disco no caminho das requisições.\n
+    Os registros vão para uma fila em memória (QueueHandler) e uma thread separada
+    (QueueListener) os grava no arquivo e no console.
+    """
+    directory = os.path.dirname(log_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()  # Redireciona as mensagens para o console
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    return listener
+
+
+class RequestLoggingMiddleware:
+    """
+    Middleware ASGI de observabilidade com custo baixo por requisição.\n
+    Registra método, caminho, status e duração de cada requisição. O corpo só é lido
+    para o log em uma amostra das requisições (LOG_BODY_SAMPLE_RATE) e, mesmo nesse caso,
+    apenas os primeiros LOG_BODY_MAX_BYTES são copiados conforme a aplicação consome o
+    corpo; nada é bufferizado antes do roteamento.
+    """
+
+    def __init__(self, app, body_sample_rate=LOG_BODY_SAMPLE_RATE, body_max_bytes=LOG_BODY_MAX_BYTES):
+        self.app = app
+        self.body_sample_rate = body_sample_rate
+        self.body_max_bytes = body_max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        captured = None
+
+        if self.body_sample_rate > 0 and random.random() < self.body_sample_rate:
+            captured = bytearray()
+            original_receive = receive
+
+            async def receive():
+                message = await original_receive()
+                if message["type"] == "http.request":
+                    missing = self.body_max_bytes + 1 - len(captured)
+                    if missing > 0:
+                        captured.extend(message.get("body", b"")[:missing])
+                return message
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            logger.info(
+                "%s %s -> %d em %.3fs",
+                scope["method"],
+                scope["path"],
+                status_code,
+                time.perf_counter() - start_time,
+            )
+            if captured:
+                truncated = len(captured) > self.body_max_bytes
+                logger.info(
+                    "Corpo da requisição (amostra): %s%s",
+                    bytes(captured[:self.body_max_bytes]).decode("utf-8", errors="replace"),
+                    "..." if truncated else "",
+                )
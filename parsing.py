@@ -0,0 +1,71 @@
+"""
+Extração e validação das respostas estruturadas do Gemini.
+
+O texto gerado é decodificado e validado uma única vez, no servidor, antes de ir para o
+cache ou para a resposta: o front-end recebe objetos prontos em vez de JSON dentro de
+strings, e uma saída malformada vira fallback aqui mesmo em vez de quebrar o cliente.
+"""
+import json
+import re
+
+from pydantic import ValidationError
+
+from models.responses import ProcessDescription, Poem
+
+# strict=False aceita quebras de linha literais dentro das strings, comuns em poemas gerados
+_decoder = json.JSONDecoder(strict=False)
+_FENCE = re.compile(r"^```[\w-]*[ \t]*\n?(.*?)\n?[ \t]*```$", re.DOTALL)
+
+
+class ParseError(ValueError):
+    """A resposta do modelo não contém o objeto esperado"""
+
+
+def strip_fences(text):
+    """Remove espaços, BOM e cercas de markdown (```json ... ```) em volta do texto"""
+    text = text.strip().lstrip("\ufeff").strip()
+    match = _FENCE.match(text)
+    return match.group(1).strip() if match else text
+
+
+def extract_json(text):
+    """
+    Decodifica o JSON de uma resposta do modelo.\n
+    O caminho comum (JSON puro, como no modo com responseMimeType) custa um único
+    json.loads. Se falhar, remove as cercas de markdown e decodifica a partir do primeiro
+    objeto ou lista, ignorando comentários do modelo antes ou depois dele.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    cleaned = strip_fences(text)
+    starts = [position for position in (cleaned.find("{"), cleaned.find("[")) if position >= 0]
+    if starts:
+        try:
+            return _decoder.raw_decode(cleaned, min(starts))[0]
+        except ValueError:
+            pass
+    raise ParseError(f"Resposta sem JSON válido: {text[:80]!r}")
+
+
+def parse_model(model, value):
+    """
+    Valida `value` contra o modelo pydantic e devolve o dicionário normalizado.\n
+    `value` pode ser o texto gerado (decodificado com extract_json) ou um objeto já
+    decodificado, como os itens das respostas combinadas e em lote.
+    """
+    data = extract_json(value) if isinstance(value, str) else value
+    try:
+        return model.model_validate(data).model_dump()
+    except ValidationError as e:
+        raise ParseError(f"{model.__name__} inválido ({e.error_count()} erro(s)): {e.errors()[0]['msg']}") from e
+
+
+def parse_process_description(value):
+    return parse_model(ProcessDescription, value)
+
+
+def parse_poem(value):
+    return parse_model(Poem, value)
@@ -0,0 +1,515 @@
+from models.message_evaluation import MessageEvaluation, SENTIMENT_VERSION
+from services import create_juice
+from clients import GEMINI_MODEL
+from cache import get_cache, make_cache_key
+from singleflight import SingleFlight
+from batching import MicroBatcher
+from metrics import provider_calls_in_flight
+from deadline import time_left, DEADLINE_RESPONSE_MARGIN_SECONDS
+from precomputed import PrecomputedStore, PRECOMPUTED_DB_PATH
+from parsing import extract_json, parse_process_description, parse_poem, ParseError
+from prompts import PROCESS_TEMPLATE, POEM_TEMPLATE, COMBINED_TEMPLATE, BATCH_TEMPLATE, render_batch
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Número máximo de requisições HTTP ao Gemini em andamento ao mesmo tempo (a espera por cota
+# não ocupa vaga); o sentimento tem o próprio limite, SENTIMENT_MAX_CONCURRENT_BATCHES
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", 8))
+
+# Versões dos templates de prompt (ver prompts.py); fazem parte da chave do cache
+PROCESS_PROMPT_VERSION = PROCESS_TEMPLATE.version
+POEM_PROMPT_VERSION = POEM_TEMPLATE.version
+COMBINED_PROMPT_VERSION = COMBINED_TEMPLATE.version
+BATCH_PROMPT_VERSION = BATCH_TEMPLATE.version
+# Os modos "combined" e "batched" gravam as mesmas chaves (ver _combined_cache_keys), então a
+# versão delas inclui os dois templates: trocar qualquer um invalida o que o outro gravou
+GENERATED_PROMPT_VERSION = f"{COMBINED_PROMPT_VERSION}+{BATCH_PROMPT_VERSION}"
+# Formato das partes geradas em MessageAnalysis.dict(): "objects" desde que as respostas do
+# Gemini passaram a ser validadas e guardadas como objetos (antes eram o texto gerado)
+ANALYSIS_FORMAT_VERSION = "objects-v1"
+# Versão de uma análise completa, usada pelas análises pré-computadas
+ANALYSIS_VERSION = "/".join(
+    (SENTIMENT_VERSION, PROCESS_PROMPT_VERSION, POEM_PROMPT_VERSION, COMBINED_PROMPT_VERSION,
+     BATCH_PROMPT_VERSION, GEMINI_MODEL, ANALYSIS_FORMAT_VERSION)
+)
+
+# Modo de geração no Gemini:
+#   "separate" - duas chamadas por mensagem (processo e poema), como originalmente
+#   "combined" - uma única chamada por mensagem com saída JSON estruturada
+#   "batched"  - uma única chamada para até GEMINI_BATCH_SIZE mensagens, inclusive de requisições simultâneas
+GEMINI_GENERATION_MODE = os.getenv("GEMINI_GENERATION_MODE", "separate")
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", 5))
+# No modo "batched", espera máxima (ms) para juntar num mesmo lote mensagens de requisições
+# simultâneas; com tráfego leve a janela é zero (ver batching.MicroBatcher)
+GEMINI_BATCH_MAX_WAIT_MS = float(os.getenv("GEMINI_BATCH_MAX_WAIT_MS", 25))
+
+# Coalescência das gerações em andamento no Gemini, pela mesma chave do cache: requisições
+# simultâneas com a mesma mensagem aguardam uma única chamada em vez de gastar a cota duas vezes
+gemini_flights = SingleFlight("gemini")
+
+
+def process_fallback(message):
+    """Descrição do processo devolvida quando não foi possível gerá-la"""
+    return {
+        "title": f"Análise de Sentimentos para: {message}",
+        "summary": "Não foi possível processar a análise detalhada",
+        "steps": [{"step_title": "Erro na análise", "step_content": "Ocorreu um erro ao gerar a análise detalhada."}],
+        "conclusion": "Por favor, tente novamente com outra frase."
+    }
+
+
+def poem_fallback():
+    """Poema devolvido quando não foi possível gerá-lo"""
+    return {
+        "title": "Reflexão",
+        "style": "Livre",
+        "mood": "Neutro",
+        "lines": ["Não foi possível gerar um poema para esta mensagem."]
+    }
+
+
+class MessageAnalysis:
+    """
+    Resultado completo do processamento de uma única mensagem.\n
+    `process_description` e `poem` são dicionários já validados (ver parsing.py).
+    """
+    evaluation: MessageEvaluation
+    process_description: dict
+    poem: dict
+
+    def __init__(self, evaluation, process_description, poem):
+        self.evaluation = evaluation
+        self.process_description = process_description
+        self.poem = poem
+
+    def dict(self):
+        return {
+            "message_evaluation": self.evaluation.dict(),
+            "process_description": self.process_description,
+            "poem": self.poem,
+        }
+
+    @classmethod
+    def from_dict(cls, message, data):
+        """Reconstrói o resultado a partir de `dict()` (ex.: análise pré-computada)"""
+        evaluation = data["message_evaluation"]
+        return cls(
+            MessageEvaluation(message, [{"label": evaluation["label"], "score": evaluation["score"]}]),
+            data["process_description"],
+            data["poem"],
+        )
+
+
+class AnalysisPipeline:
+    """
+    Motor de execução assíncrono da análise.\n
+    Dispara ao mesmo tempo a avaliação de sentimento, a descrição do processo e o
+    poema de todas as mensagens do lote, respeitando um limite de concorrência,
+    e devolve os resultados na mesma ordem das mensagens recebidas.
+    """
+
+    def __init__(self, max_concurrency=ANALYSIS_MAX_CONCURRENCY, generation_mode=GEMINI_GENERATION_MODE,
+                 batch_size=GEMINI_BATCH_SIZE, precomputed=None):
+        self.max_concurrency = max_concurrency
+        self.generation_mode = generation_mode
+        self.batch_size = max(1, batch_size)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.precomputed = precomputed or PrecomputedStore(PRECOMPUTED_DB_PATH, ANALYSIS_VERSION)
+        self.gemini_batcher = MicroBatcher(
+            "gemini", self._combined_batch_uncached, self.batch_size, GEMINI_BATCH_MAX_WAIT_MS / 1000
+        )
+
+    @contextlib.asynccontextmanager
+    async def _call_slot(self):
+        """Vaga de chamada ao provedor; no Gemini só envolve a requisição HTTP (ver create_juice)"""
+        async with self.semaphore:
+            with provider_calls_in_flight.track_inprogress():
+                yield
+
+    async def evaluate(self, message):
+        """Avaliação de uma mensagem avulsa, pelo mesmo caminho em lote das demais"""
+        return (await self.evaluate_many([message]))[0]
+
+    async def _generate(self, message, template, cache_key, parse):
+        """
+        Consulta o cache antes de chamar create_juice; devolve o objeto validado por `parse`.\n
+        Só respostas válidas vão para o cache, já normalizadas. Uma entrada que não passa
+        na validação (ex.: gravada antes dela existir) é tratada como ausente.
+        """
+        cached = (await get_cache().aget_many([cache_key]))[0]
+        if cached is not None:
+            try:
+                value = parse(cached)
+                logger.debug("Conteúdo encontrado no cache, chamada ao Gemini evitada")
+                return value
+            except ParseError as e:
+                logger.warning(f"Conteúdo inválido no cache descartado: {str(e)}")
+
+        return await gemini_flights.do(cache_key, self._generate_uncached, message, template, cache_key, parse)
+
+    async def _generate_uncached(self, message, template, cache_key, parse):
+        response = await create_juice(template.render(message), cache_key, kind=template.kind, call_slot=self._call_slot)
+        value = parse(response.text)
+        await get_cache().aset_many([(cache_key, json.dumps(value, ensure_ascii=False))])
+        return value
+
+    async def process_description(self, message):
+        try:
+            logger.debug("Gerando descrição do processo de análise...")
+            process_start = time.time()
+            cache_key = make_cache_key("process", message, PROCESS_PROMPT_VERSION, GEMINI_MODEL)
+            process_description = await self._generate(message, PROCESS_TEMPLATE, cache_key, parse_process_description)
+            logger.debug(f"Descrição do processo gerada em {time.time() - process_start:.2f} segundos")
+            return process_description
+        except Exception as e:
+            logger.error(f"Erro ao gerar descrição do processo: {str(e)}")
+            return process_fallback(message)
+
+    async def poem(self, message):
+        try:
+            logger.debug("Gerando poema baseado na mensagem...")
+            poem_start = time.time()
+            cache_key = make_cache_key("poem", message, POEM_PROMPT_VERSION, GEMINI_MODEL)
+            poem = await self._generate(message, POEM_TEMPLATE, cache_key, parse_poem)
+            logger.debug(f"Poema gerado em {time.time() - poem_start:.2f} segundos")
+            return poem
+        except Exception as e:
+            logger.error(f"Erro ao gerar poema: {str(e)}")
+            return poem_fallback()
+
+    @staticmethod
+    def _combined_cache_keys(message):
+        return (
+            make_cache_key("process", message, GENERATED_PROMPT_VERSION, GEMINI_MODEL),
+            make_cache_key("poem", message, GENERATED_PROMPT_VERSION, GEMINI_MODEL),
+        )
+
+    @staticmethod
+    def _parse_cached_combined(cached):
+        """Descrição do processo e poema lidos do cache, ou None se faltar uma das partes ou ela for inválida"""
+        if None in cached:
+            return None
+        try:
+            return parse_process_description(cached[0]), parse_poem(cached[1])
+        except ParseError as e:
+            logger.warning(f"Conteúdo combinado inválido no cache descartado: {str(e)}")
+            return None
+
+    @staticmethod
+    def _split_combined(item):
+        """Valida as partes de um objeto {"process_description", "poem"}"""
+        return parse_process_description(item["process_description"]), parse_poem(item["poem"])
+
+    @staticmethod
+    async def _store_combined(generated):
+        """Grava no cache, de uma vez, as partes `[(chaves do cache, (descrição, poema))]` geradas"""
+        await get_cache().aset_many([
+            (cache_key, json.dumps(value, ensure_ascii=False))
+            for cache_keys, parts in generated
+            for cache_key, value in zip(cache_keys, parts)
+        ])
+
+    async def combined(self, message):
+        """Gera descrição do processo e poema com uma única chamada estruturada ao Gemini"""
+        cache_keys = self._combined_cache_keys(message)
+        cached = self._parse_cached_combined(await get_cache().aget_many(cache_keys))
+        if cached is not None:
+            logger.debug("Conteúdo combinado encontrado no cache, chamada ao Gemini evitada")
+            return cached
+
+        # Os modos "combined" e "batched" compartilham a chave: uma geração em lote em
+        # andamento também atende uma requisição combinada da mesma mensagem
+        return await gemini_flights.do(cache_keys[0], self._combined_uncached, message, cache_keys)
+
+    async def _combined_uncached(self, message, cache_keys):
+        try:
+            logger.debug("Gerando descrição do processo e poema em uma única chamada...")
+            combined_start = time.time()
+            response = await create_juice(
+                COMBINED_TEMPLATE.render(message), cache_keys[0], COMBINED_TEMPLATE.generation_config,
+                kind=COMBINED_TEMPLATE.kind, call_slot=self._call_slot,
+            )
+            result = self._split_combined(extract_json(response.text))
+            await self._store_combined([(cache_keys, result)])
+            logger.debug(f"Conteúdo combinado gerado em {time.time() - combined_start:.2f} segundos")
+            return result
+        except Exception as e:
+            logger.error(f"Erro ao gerar conteúdo combinado: {str(e)}")
+            return process_fallback(message), poem_fallback()
+
+    async def combined_batch(self, messages):
+        """
+        Gera descrição do processo e poema de várias mensagens com uma única chamada ao Gemini.\n
+        A resposta é separada de volta por índice; mensagens ausentes ou inválidas na
+        resposta recebem os fallbacks de sempre, sem afetar as demais.
+        """
+        results = [None] * len(messages)
+        pending = []
+        all_cache_keys = [self._combined_cache_keys(message) for message in messages]
+        cached_values = await get_cache().aget_many([key for cache_keys in all_cache_keys for key in cache_keys])
+        for index, (message, cache_keys) in enumerate(zip(messages, all_cache_keys)):
+            cached = self._parse_cached_combined(cached_values[2 * index:2 * index + 2])
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append((index, message, cache_keys))
+
+        if not pending:
+            return results
+
+        # Mensagens repetidas no lote, ou já em geração por outra requisição, não são reenviadas;
+        # as demais vão para o agrupador, que pode juntá-las às de outras requisições na mesma chamada
+        pending_by_key = {cache_keys[0]: (message, cache_keys) for _, message, cache_keys in pending}
+        generated = await gemini_flights.do_many(
+            list(pending_by_key), lambda keys: self.gemini_batcher.submit_many([pending_by_key[key] for key in keys])
+        )
+        for index, _, cache_keys in pending:
+            results[index] = generated[cache_keys[0]]
+        return results
+
+    async def _combined_batch_uncached(self, pending):
+        """Gera em uma única chamada as mensagens `[(mensagem, chaves do cache)]`, na mesma ordem"""
+        items_by_index = {}
+        try:
+            logger.debug(f"Gerando conteúdo para {len(pending)} mensagens em uma única chamada...")
+            batch_start = time.time()
+            response = await create_juice(
+                render_batch([message for message, _ in pending]), None,
+                BATCH_TEMPLATE.generation_config, kind=BATCH_TEMPLATE.kind, call_slot=self._call_slot,
+            )
+            items_by_index = {item["index"]: item for item in extract_json(response.text)["results"]}
+            logger.debug(f"Lote de {len(pending)} mensagens gerado em {time.time() - batch_start:.2f} segundos")
+        except Exception as e:
+            logger.error(f"Erro ao gerar conteúdo em lote: {str(e)}")
+
+        results = []
+        generated = []
+        for index, (message, cache_keys) in enumerate(pending):
+            try:
+                results.append(self._split_combined(items_by_index[index]))
+                generated.append((cache_keys, results[-1]))
+            except Exception as e:
+                logger.error(f"Resposta em lote sem resultado válido para a mensagem {index}: {str(e)}")
+                results.append((process_fallback(message), poem_fallback()))
+        await self._store_combined(generated)
+        return results
+
+    async def evaluate_many(self, message_list):
+        return await MessageEvaluation.create_many(message_list)
+
+    @staticmethod
+    async def _evaluation_from_batch(batch, index):
+        # shield: cancelar uma mensagem não pode cancelar a avaliação em lote das demais
+        return (await asyncio.shield(batch))[index]
+
+    async def analyze_message(self, message, on_part=None, evaluate=None):
+        """
+        Analisa uma mensagem. Se `on_part(tipo, valor)` for informado, ele é chamado assim que
+        cada parte fica pronta ("message_evaluation", "process_description" e "poem").
+        `evaluate` permite fornecer a função (sem argumentos) que obtém a avaliação (ex.: vinda de um lote).
+        """
+        notify = on_part or (lambda kind, value: None)
+        evaluate = evaluate or (lambda: self.evaluate(message))
+
+        # Cada parte recebe a função, não a corrotina: se o prazo acabar antes de a parte
+        # começar, nenhuma corrotina fica criada sem nunca ser aguardada
+        async def part(kind, coroutine_function, *args):
+            value = await coroutine_function(*args)
+            notify(kind, value)
+            return value
+
+        if self.generation_mode == "combined":
+            async def combined_parts():
+                process_description, poem = await self.combined(message)
+                notify("process_description", process_description)
+                notify("poem", poem)
+                return process_description, poem
+
+            evaluation, (process_description, poem) = await asyncio.gather(
+                part("message_evaluation", evaluate),
+                combined_parts(),
+            )
+        else:
+            evaluation, process_description, poem = await asyncio.gather(
+                part("message_evaluation", evaluate),
+                part("process_description", self.process_description, message),
+                part("poem", self.poem, message),
+            )
+        return MessageAnalysis(evaluation, process_description, poem)
+
+    async def _analyze_batch(self, offset, batch, on_part=None, evaluation_for=None):
+        """Analisa um lote do modo "batched": avaliações individuais e uma única geração no Gemini"""
+        notify = on_part or (lambda index, kind, value: None)
+        evaluation_for = evaluation_for or (lambda index: self.evaluate(batch[index - offset]))
+
+        async def evaluate(index, message):
+            evaluation = await evaluation_for(index)
+            notify(index, "message_evaluation", evaluation)
+            return evaluation
+
+        async def generate():
+            generations = await self.combined_batch(batch)
+            for index, (process_description, poem) in enumerate(generations):
+                notify(offset + index, "process_description", process_description)
+                notify(offset + index, "poem", poem)
+            return generations
+
+        evaluations, generations = await asyncio.gather(
+            asyncio.gather(*(evaluate(offset + index, message) for index, message in enumerate(batch))),
+            generate(),
+        )
+        return [
+            (offset + index, MessageAnalysis(evaluation, process_description, poem))
+            for index, (evaluation, (process_description, poem)) in enumerate(zip(evaluations, generations))
+        ]
+
+    async def _analyze_indexed(self, index, message, on_part=None, evaluation_for=None):
+        notify = (lambda kind, value: on_part(index, kind, value)) if on_part else None
+        evaluate = (lambda: evaluation_for(index)) if evaluation_for else None
+        return [(index, await self.analyze_message(message, notify, evaluate))]
+
+    @staticmethod
+    def is_complete(message, result):
+        """Indica se nenhuma parte do resultado caiu em fallback"""
+        return (
+            result.evaluation.label not in ("ERROR", "UNDEFINED")
+            and result.process_description != process_fallback(message)
+            and result.poem != poem_fallback()
+        )
+
+    async def stream(self, message_list, on_part=None):
+        """
+        Gerador assíncrono que entrega `(índice, MessageAnalysis)` à medida que cada mensagem
+        termina, na ordem de conclusão. Se o consumidor parar de iterar, o trabalho
+        pendente é cancelado. `on_part(índice, tipo, valor)` é chamado a cada parte concluída.
+        Mensagens com análise pré-computada são entregues primeiro, sem chamadas externas.
+        """
+        pending = []
+        for index, message in enumerate(message_list):
+            data = self.precomputed.lookup(message)
+            if data is None:
+                pending.append(index)
+                continue
+            result = MessageAnalysis.from_dict(message, data)
+            if on_part:
+                on_part(index, "message_evaluation", result.evaluation)
+                on_part(index, "process_description", result.process_description)
+                on_part(index, "poem", result.poem)
+            yield index, result
+
+        if len(pending) < len(message_list):
+            if pending:
+                logger.debug(f"{len(message_list) - len(pending)} mensagens respondidas com análises pré-computadas")
+                local_on_part = (lambda local, kind, value: on_part(pending[local], kind, value)) if on_part else None
+                async for local, result in self._stream_computed([message_list[index] for index in pending],
+                                                                 local_on_part):
+                    yield pending[local], result
+            return
+
+        async for item in self._stream_computed(message_list, on_part):
+            yield item
+
+    async def _stream_computed(self, message_list, on_part=None):
+        # O sentimento de todas as mensagens da requisição é avaliado com uma chamada em lote
+        # (textos repetidos são avaliados uma única vez)
+        batch_evaluation = asyncio.ensure_future(self.evaluate_many(message_list))
+        tasks = [batch_evaluation]
+        evaluation_for = lambda index: self._evaluation_from_batch(batch_evaluation, index)
+
+        if self.generation_mode == "batched":
+            unit_tasks = [
+                asyncio.ensure_future(
+                    self._analyze_batch(offset, message_list[offset:offset + self.batch_size], on_part, evaluation_for)
+                )
+                for offset in range(0, len(message_list), self.batch_size)
+            ]
+        else:
+            unit_tasks = [
+                asyncio.ensure_future(self._analyze_indexed(index, message, on_part, evaluation_for))
+                for index, message in enumerate(message_list)
+            ]
+        tasks.extend(unit_tasks)
+        try:
+            for next_done in asyncio.as_completed(unit_tasks):
+                for item in await next_done:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream_parts(self, message_list):
+        """
+        Gerador assíncrono de `(índice, tipo, valor)` para cada parte de cada mensagem, emitida
+        assim que fica pronta: a avaliação de sentimento não espera o poema, por exemplo.
+        """
+        parts = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for _ in self.stream(message_list, lambda *part: parts.put_nowait(part)):
+                    pass
+            finally:
+                parts.put_nowait(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while (part := await parts.get()) is not None:
+                yield part
+            # Propaga eventuais erros do produtor
+            await producer
+        finally:
+            producer.cancel()
+
+    @staticmethod
+    def partial_result(message, parts):
+        """Monta o resultado de uma mensagem com as partes já prontas e fallbacks no lugar das demais"""
+        evaluation = parts.get("message_evaluation") or MessageEvaluation.unavailable(message)
+        process_description = parts.get("process_description") or process_fallback(message)
+        poem = parts.get("poem") or poem_fallback()
+        return MessageAnalysis(evaluation, process_description, poem)
+
+    async def run(self, message_list):
+        """
+        Processa todas as mensagens concorrentemente; a ordem da entrada é preservada.\n
+        Se o prazo da requisição acabar antes, devolve o que ficou pronto e completa o
+        restante com os fallbacks (o trabalho pendente é cancelado).
+        """
+        logger.info(
+            f"Iniciando análise para {len(message_list)} mensagens "
+            f"(concorrência máxima: {self.max_concurrency}, modo de geração: {self.generation_mode})"
+        )
+        start_time = time.time()
+
+        results = [None] * len(message_list)
+        parts = [{} for _ in message_list]
+
+        def keep_part(index, kind, value):
+            parts[index][kind] = value
+
+        try:
+            # Sem prazo na requisição (ex.: jobs), time_left devolve None e não há limite
+            async with asyncio.timeout(time_left(margin=DEADLINE_RESPONSE_MARGIN_SECONDS)):
+                async for index, result in self.stream(message_list, keep_part):
+                    results[index] = result
+        except TimeoutError:
+            missing = [index for index, result in enumerate(results) if result is None]
+            logger.warning(
+                f"Prazo da requisição esgotado: {len(missing)} de {len(message_list)} mensagens "
+                f"completadas com fallbacks"
+            )
+            for index in missing:
+                results[index] = self.partial_result(message_list[index], parts[index])
+
+        total_time = time.time() - start_time
+        logger.debug(f"Análise completa finalizada em {total_time:.2f} segundos")
+        return results
+
+
+# Instância compartilhada pela API: o limite de concorrência vale para todas as requisições
+default_pipeline = AnalysisPipeline()
@@ -0,0 +1,190 @@
+"""
+Análises pré-computadas para as mensagens mais frequentes.
+
+As análises completas (sentimento, descrição do processo e poema) ficam em um SQLite
+compacto, carregado inteiro para um dicionário no startup da API: a consulta é O(1) e
+mensagens conhecidas são respondidas sem nenhuma chamada externa.
+
+Para gerar o arquivo a partir de um JSONL de mensagens (uma por linha, como string JSON
+ou objeto com o campo indicado em --field):
+    python precomputed.py mensagens.jsonl
+A execução pode ser interrompida e retomada: mensagens já gravadas são puladas.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from os.path import join, dirname
+
+from dotenv import load_dotenv
+
+if __name__ == "__main__":
+    # Como CLI este módulo é o ponto de entrada: o .env é carregado antes dos módulos que
+    # leem a configuração ao serem importados (cache, métricas e PRECOMPUTED_DB_PATH abaixo)
+    load_dotenv(join(dirname(__file__), '.env'))
+
+from cache import normalize_message
+from metrics import precomputed_lookups_total
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTED_DB_PATH = os.getenv("PRECOMPUTED_DB_PATH", "data/precomputed.db")
+
+
+class PrecomputedStore:
+    """
+    Índice mensagem normalizada → análise completa.\n
+    Só as linhas da `version` atual (versões de prompts, modelo e formato do sentimento)
+    são carregadas; análises geradas com prompts antigos são ignoradas.
+    """
+
+    def __init__(self, path=PRECOMPUTED_DB_PATH, version=""):
+        self.path = path
+        self.version = version
+        self.loaded = False
+        self.hits = 0
+        self._entries = {}
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                "message_key TEXT NOT NULL, version TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (message_key, version))"
+            )
+        return self._connection
+
+    def load(self):
+        """Carrega o arquivo para a memória (chamado no startup; sem arquivo, fica vazio)"""
+        if self.loaded:
+            return
+        start_time = time.time()
+        entries = {}
+        if os.path.exists(self.path):
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT message_key, result FROM analyses WHERE version = ?", (self.version,)
+                ).fetchall()
+            entries = {message_key: json.loads(result) for message_key, result in rows}
+        self._entries = entries
+        self.loaded = True
+        logger.info(
+            f"{len(entries)} análises pré-computadas carregadas de {self.path} em {time.time() - start_time:.2f} segundos"
+        )
+
+    def lookup(self, message):
+        """Devolve o dicionário da análise pré-computada da mensagem, ou None"""
+        if not self._entries:
+            return None
+        result = self._entries.get(normalize_message(message))
+        if result is None:
+            precomputed_lookups_total.labels("miss").inc()
+            return None
+        self.hits += 1
+        precomputed_lookups_total.labels("hit").inc()
+        return result
+
+    def completed_keys(self):
+        """Mensagens (normalizadas) que já têm análise gravada na versão atual"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT message_key FROM analyses WHERE version = ?", (self.version,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def save(self, message, result):
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO analyses (message_key, version, result, created_at) VALUES (?, ?, ?, ?)",
+                (normalize_message(message), self.version, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"loaded": self.loaded, "entries": len(self._entries), "hits": self.hits, "path": self.path}
+
+
+def read_messages(path, field="message"):
+    """Lê as mensagens de um JSONL (strings JSON ou objetos com `field`), ignorando linhas vazias"""
+    messages = []
+    with open(path, encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                logger.warning(f"Linha {line_number} ignorada: JSON inválido")
+                continue
+            message = item if isinstance(item, str) else item.get(field) if isinstance(item, dict) else None
+            if isinstance(message, str) and message.strip():
+                messages.append(message)
+            else:
+                logger.warning(f"Linha {line_number} ignorada: campo '{field}' ausente")
+    return messages
+
+
+async def precompute(messages, batch_size):
+    """Analisa as mensagens ainda não gravadas, em blocos, gravando cada resultado completo"""
+    from clients import init_clients, close_clients
+    from pipeline import default_pipeline
+    from rate_limiter import current_client_id, current_priority, PRIORITY_BACKGROUND
+    from sentiment_backends import get_sentiment_backend
+
+    store = default_pipeline.precomputed
+    done = await asyncio.to_thread(store.completed_keys)
+    pending = list({normalize_message(message): message for message in messages
+                    if normalize_message(message) not in done}.values())
+    logger.info(f"{len(messages)} mensagens lidas; {len(pending)} ainda sem análise pré-computada")
+
+    # Mesma prioridade dos jobs: não atrapalha requisições interativas no mesmo processo
+    current_priority.set(PRIORITY_BACKGROUND)
+    current_client_id.set("precompute")
+    init_clients()
+    await asyncio.to_thread(get_sentiment_backend().load)
+
+    saved = 0
+    failed = 0
+    try:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            async for index, result in default_pipeline.stream(chunk):
+                if default_pipeline.is_complete(chunk[index], result):
+                    await asyncio.to_thread(store.save, chunk[index], result.dict())
+                    saved += 1
+                else:
+                    failed += 1
+            logger.info(f"Progresso: {min(start + batch_size, len(pending))}/{len(pending)} mensagens")
+    finally:
+        await close_clients()
+    logger.info(f"Pré-computação concluída: {saved} gravadas, {failed} com fallback (serão refeitas na próxima execução)")
+
+
+if __name__ == "__main__":
+    from observability import setup_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="arquivo JSONL com as mensagens")
+    parser.add_argument("--field", default="message", help="campo da mensagem quando a linha é um objeto")
+    parser.add_argument("--batch-size", type=int, default=20, help="mensagens analisadas por bloco")
+    args = parser.parse_args()
+
+    setup_logging("logs/precompute.log")
+    try:
+        asyncio.run(precompute(read_messages(args.input, args.field), max(1, args.batch_size)))
+    except KeyboardInterrupt:
+        logger.info("Pré-computação interrompida; a próxima execução continua de onde parou")
@@ -0,0 +1,207 @@
+"""
+Templates de prompt do Gemini, versionados e compilados uma única vez na importação.
+
+Cada template guarda só as instruções, sem a indentação do código, e termina no rótulo
+da entrada: `render` acrescenta a mensagem uma única vez, ao final, já ajustada ao
+orçamento de tokens (PROMPT_MAX_MESSAGE_TOKENS). A versão do template faz parte da chave
+do cache, então qualquer alteração no texto deve vir acompanhada de um novo número.
+"""
+import json
+import logging
+import os
+import textwrap
+
+from metrics import prompt_truncations_total
+
+logger = logging.getLogger(__name__)
+
+# Máximo de tokens (estimados) de uma mensagem dentro do prompt; o excedente é cortado no meio
+PROMPT_MAX_MESSAGE_TOKENS = int(os.getenv("PROMPT_MAX_MESSAGE_TOKENS", 1000))
+
+# Média usada na estimativa de tokens (texto em português no tokenizador do Gemini)
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = " [...] "
+
+
+def estimate_tokens(text):
+    """Estimativa barata de tokens (~4 caracteres por token) usada antes de conhecer o uso real"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_budget(text, max_tokens, kind="generic"):
+    """
+    Corta `text` para caber em `max_tokens` tokens estimados, preservando começo e fim.\n
+    O meio é trocado por TRUNCATION_MARKER: o início costuma trazer o assunto e o final a
+    conclusão de quem escreveu, os trechos que mais pesam no sentimento. Os cortes são
+    feitos em espaços, sem partir palavras.
+    """
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+
+    available = max(2, (max_tokens - 1) * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    head = text[:available * 2 // 3]
+    tail = text[len(text) - available // 3:]
+    if " " in head:
+        head = head.rsplit(" ", 1)[0]
+    if " " in tail:
+        tail = tail.split(" ", 1)[1]
+    prompt_truncations_total.labels(kind).inc()
+    logger.debug(f"Mensagem de {len(text)} caracteres cortada para caber em {max_tokens} tokens")
+    return f"{head.rstrip()}{TRUNCATION_MARKER}{tail.lstrip()}"
+
+
+class PromptTemplate:
+    """Template versionado: instruções fixas, configuração de geração e rótulo da entrada"""
+
+    def __init__(self, kind, version, instructions, generation_config=None, input_label="Mensagem"):
+        self.kind = kind
+        self.version = version
+        self.text = textwrap.dedent(instructions).strip()
+        self.generation_config = generation_config
+        self.input_label = input_label
+        self.instruction_tokens = estimate_tokens(self.text)
+
+    def render(self, value, max_tokens=PROMPT_MAX_MESSAGE_TOKENS):
+        """Prompt final com `value` (ajustado a `max_tokens`; None não corta) ao final"""
+        return f"{self.text}\n\n{self.input_label}: {truncate_to_budget(value, max_tokens, self.kind)}"
+
+
+# Esquemas de resposta (subconjunto OpenAPI aceito pelo Gemini) usados nos modos combinados
+PROCESS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "steps": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "step_title": {"type": "STRING"},
+                    "step_content": {"type": "STRING"},
+                },
+                "required": ["step_title", "step_content"],
+            },
+        },
+        "conclusion": {"type": "STRING"},
+    },
+    "required": ["title", "summary", "steps", "conclusion"],
+}
+
+POEM_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "style": {"type": "STRING"},
+        "mood": {"type": "STRING"},
+        "lines": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["title", "style", "mood", "lines"],
+}
+
+COMBINED_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": {
+        "type": "OBJECT",
+        "properties": {"process_description": PROCESS_SCHEMA, "poem": POEM_SCHEMA},
+        "required": ["process_description", "poem"],
+    },
+}
+
+BATCH_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": {
+        "type": "OBJECT",
+        "properties": {
+            "results": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "index": {"type": "INTEGER"},
+                        "process_description": PROCESS_SCHEMA,
+                        "poem": POEM_SCHEMA,
+                    },
+                    "required": ["index", "process_description", "poem"],
+                },
+            },
+        },
+        "required": ["results"],
+    },
+}
+
+PROCESS_TEMPLATE = PromptTemplate("process", "process-v2", """
+    Analise o sentimento da mensagem informada ao final.
+
+    Forneça uma análise detalhada do processo de análise de sentimentos para esta mensagem.
+
+    IMPORTANTE: Retorne APENAS o objeto JSON sem nenhum texto adicional, no seguinte formato:
+
+    {
+    "title": "Análise de Sentimentos para: <a mensagem>",
+    "summary": "Um breve resumo de uma linha sobre a análise geral",
+    "steps": [
+        {"step_title": "1. Pré-processamento", "step_content": "Descrição detalhada desta etapa"},
+        {"step_title": "2. Identificação de Palavras-Chave", "step_content": "Descrição detalhada desta etapa"},
+        {"step_title": "3. Determinação da Polaridade", "step_content": "Descrição detalhada desta etapa"},
+        {"step_title": "4. Cálculo de Intensidade", "step_content": "Descrição detalhada desta etapa"},
+        {"step_title": "5. Classificação Final", "step_content": "Descrição detalhada desta etapa"}
+    ],
+    "conclusion": "Uma conclusão sobre o sentimento detectado e sua justificativa"
+    }
+    """)
+
+POEM_TEMPLATE = PromptTemplate("poem", "poem-v2", """
+    Com base na mensagem informada ao final, crie um poema expressivo que capture a essência
+    emocional dela.
+
+    IMPORTANTE: Retorne APENAS o objeto JSON sem nenhum texto adicional (como markdown para json, "```json``` ou qualquer marcação), no seguinte formato:
+
+    {
+    "title": "Título criativo relacionado à mensagem",
+    "style": "Estilo do poema (livre, soneto, haiku, etc)",
+    "mood": "Humor predominante do poema (melancólico, alegre, reflexivo, etc)",
+    "lines": ["primeira linha do poema", "segunda linha do poema", "e assim por diante..."]
+    }
+
+    O poema deve ter entre 8 e 12 linhas, com linguagem poética mas acessível.
+    """)
+
+# Instruções compartilhadas pelos modos combinados
+_COMBINED_INSTRUCTIONS = textwrap.dedent("""
+    Para cada mensagem, produza dois objetos:
+
+    1. "process_description": uma análise detalhada do processo de análise de sentimentos
+       da mensagem, com "title" no formato "Análise de Sentimentos para: <mensagem>",
+       "summary" (resumo de uma linha), "steps" com exatamente estas cinco etapas
+       ("1. Pré-processamento", "2. Identificação de Palavras-Chave",
+       "3. Determinação da Polaridade", "4. Cálculo de Intensidade", "5. Classificação Final"),
+       cada uma com "step_title" e "step_content", e "conclusion" justificando o sentimento detectado.
+
+    2. "poem": um poema expressivo que capture a essência emocional da mensagem, com
+       "title" criativo, "style" (livre, soneto, haiku, etc), "mood" (melancólico, alegre,
+       reflexivo, etc) e "lines" com entre 8 e 12 linhas, em linguagem poética mas acessível.
+
+    Responda apenas com JSON seguindo o esquema fornecido.
+    """).strip()
+
+COMBINED_TEMPLATE = PromptTemplate("combined", "combined-v2", "\n\n".join((
+    "Analise a mensagem informada ao final.",
+    _COMBINED_INSTRUCTIONS,
+)), COMBINED_GENERATION_CONFIG)
+
+BATCH_TEMPLATE = PromptTemplate("batch", "batch-v2", "\n\n".join((
+    'Analise cada uma das mensagens da lista JSON informada ao final, identificadas pelo campo "index".',
+    _COMBINED_INSTRUCTIONS,
+    'Devolva em "results" um item por mensagem, repetindo o "index" correspondente.',
+)), BATCH_GENERATION_CONFIG, input_label="Mensagens")
+
+
+def render_batch(messages, max_message_tokens=PROMPT_MAX_MESSAGE_TOKENS):
+    """Prompt em lote com a lista JSON `[{"index", "message"}]`, cada mensagem no próprio orçamento"""
+    payload = json.dumps(
+        [{"index": index, "message": truncate_to_budget(message, max_message_tokens, BATCH_TEMPLATE.kind)}
+         for index, message in enumerate(messages)],
+        ensure_ascii=False,
+    )
+    return BATCH_TEMPLATE.render(payload, max_tokens=None)
@@ -0,0 +1,458 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import rate_limiter_wait_seconds, rate_limiter_queue_depth
+
+logger = logging.getLogger(__name__)
+
+# "memory": cota própria de cada processo; "sqlite": cota única compartilhada por todos os
+# processos da máquina (workers do uvicorn e workers de jobs) através de RATE_LIMIT_SQLITE_PATH
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "data/rate_limit.db")
+
+# Prioridades: números menores são atendidos primeiro
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Identidade de quem originou a chamada; definida no endpoint e herdada pelas tasks do pipeline
+current_client_id = contextvars.ContextVar("current_client_id", default="anonymous")
+current_priority = contextvars.ContextVar("current_priority", default=PRIORITY_INTERACTIVE)
+
+
+class TokenBucket:
+    """Balde de fichas clássico: `capacity` fichas, reabastecidas a `refill_per_second`"""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.updated_at = now
+
+    def time_until(self, amount, now):
+        """Segundos até haver `amount` fichas disponíveis (0 se já houver)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_per_second
+
+    def available(self, now):
+        """Fichas disponíveis em `now`, sem alterar o balde"""
+        elapsed = max(0.0, now - self.updated_at)
+        return min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self, now, until=None):
+        """Zera as fichas; com `until`, o reabastecimento só recomeça a partir desse instante"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        if until is not None:
+            self.updated_at = max(self.updated_at, until)
+
+
+class LocalQuota:
+    """Cota de um único processo: balde de requisições e balde de tokens em memória"""
+
+    # Operações que fazem E/S (ex.: SQLite) são executadas pelo escalonador fora do event loop
+    blocking = False
+
+    def __init__(self, requests_per_minute, tokens_per_minute, burst=None):
+        self.requests = TokenBucket(burst or requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self.blocked_until = 0.0
+
+    def _now(self):
+        return time.monotonic()
+
+    def reserve(self, tokens):
+        """
+        Consome uma requisição e `tokens` tokens se houver cota.\n
+        Devolve 0 quando a reserva foi feita ou os segundos até ela ser possível.
+        """
+        now = self._now()
+        delay = max(
+            self.blocked_until - now,
+            self.requests.time_until(1, now),
+            self.tokens.time_until(tokens, now),
+        )
+        if delay > 0:
+            return delay
+        self.requests.consume(1, now)
+        self.tokens.consume(tokens, now)
+        return 0.0
+
+    def adjust(self, tokens):
+        """Consome (ou devolve, se negativo) `tokens` do balde de tokens, sem passar da capacidade"""
+        now = self._now()
+        self.tokens._refill(now)
+        self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens - tokens)
+
+    def refund(self, tokens):
+        """Devolve uma reserva que não chegou a ser usada (uma requisição e `tokens` tokens)"""
+        now = self._now()
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            bucket._refill(now)
+            bucket.tokens = min(bucket.capacity, bucket.tokens + min(amount, bucket.capacity))
+
+    def block(self, seconds):
+        """Suspende a cota por `seconds` segundos, sem rajada acumulada ao final da pausa"""
+        now = self._now()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.requests.drain(now, until=self.blocked_until)
+
+    def snapshot(self):
+        now = self._now()
+        return {
+            "blocked_for_seconds": max(0.0, self.blocked_until - now),
+            "available_requests": self.requests.available(now),
+            "available_tokens": self.tokens.available(now),
+        }
+
+
+class SQLiteQuota(LocalQuota):
+    """
+    Cota compartilhada entre processos, guardada em um SQLite local.\n
+    Cada limitador ocupa uma linha com o estado dos dois baldes e da pausa pedida pelo
+    provedor. Toda operação lê, atualiza e grava essa linha dentro de uma transação
+    BEGIN IMMEDIATE, então dois processos nunca gastam a mesma ficha e um 429 visto por
+    um worker pausa todos. O relógio é o de parede (time.time), comum aos processos.
+    As operações bloqueiam (até o timeout do SQLite em caso de disputa) e por isso o
+    escalonador as executa em threads; `snapshot` só lê o estado da última transação.
+    """
+
+    blocking = True
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute, burst=None, path=RATE_LIMIT_SQLITE_PATH):
+        super().__init__(requests_per_minute, tokens_per_minute, burst)
+        self.name = name
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _now(self):
+        return time.time()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            # As transações duram microssegundos; o timeout só cobre disputas momentâneas
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS quotas ("
+                "name TEXT PRIMARY KEY, requests REAL NOT NULL, requests_updated_at REAL NOT NULL, "
+                "tokens REAL NOT NULL, tokens_updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+            )
+            now = time.time()
+            connection.execute(
+                "INSERT OR IGNORE INTO quotas VALUES (?, ?, ?, ?, ?, 0)",
+                (self.name, self.requests.capacity, now, self.tokens.capacity, now),
+            )
+            self._connection = connection
+        return self._connection
+
+    def _transaction(self, operation, *args):
+        """Executa `operation` sobre o estado compartilhado, gravando o resultado atomicamente"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT requests, requests_updated_at, tokens, tokens_updated_at, blocked_until "
+                    "FROM quotas WHERE name = ?", (self.name,)
+                ).fetchone()
+                # Limites de outra configuração (ex.: antes de um redeploy) são ajustados aos atuais
+                self.requests.tokens = min(row[0], self.requests.capacity)
+                self.requests.updated_at = row[1]
+                self.tokens.tokens = min(row[2], self.tokens.capacity)
+                self.tokens.updated_at = row[3]
+                self.blocked_until = row[4]
+                result = operation(*args)
+                connection.execute(
+                    "UPDATE quotas SET requests = ?, requests_updated_at = ?, tokens = ?, tokens_updated_at = ?, "
+                    "blocked_until = ? WHERE name = ?",
+                    (self.requests.tokens, self.requests.updated_at, self.tokens.tokens, self.tokens.updated_at,
+                     self.blocked_until, self.name),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return result
+
+    def reserve(self, tokens):
+        try:
+            return self._transaction(super().reserve, tokens)
+        except sqlite3.Error as e:
+            # Sem acesso ao estado compartilhado não dá para garantir a cota: tenta de novo em seguida
+            logger.warning(f"[{self.name}] Falha ao reservar cota compartilhada: {e}")
+            return 0.1
+
+    def adjust(self, tokens):
+        try:
+            self._transaction(super().adjust, tokens)
+        except sqlite3.Error as e:
+            logger.warning(f"[{self.name}] Falha ao ajustar a cota compartilhada: {e}")
+
+    def refund(self, tokens):
+        try:
+            self._transaction(super().refund, tokens)
+        except sqlite3.Error as e:
+            logger.warning(f"[{self.name}] Falha ao devolver reserva à cota compartilhada: {e}")
+
+    def block(self, seconds):
+        try:
+            self._transaction(super().block, seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"[{self.name}] Falha ao registrar pausa na cota compartilhada: {e}")
+            super().block(seconds)
+
+
+def create_quota(name, requests_per_minute, tokens_per_minute, burst=None, backend=RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        return SQLiteQuota(name, requests_per_minute, tokens_per_minute, burst)
+    return LocalQuota(requests_per_minute, tokens_per_minute, burst)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "client_id", "enqueued_at")
+
+    def __init__(self, future, tokens, client_id, enqueued_at):
+        self.future = future
+        self.tokens = tokens
+        self.client_id = client_id
+        self.enqueued_at = enqueued_at
+
+
+class RateLimitScheduler:
+    """
+    Escalonador assíncrono de rate limiting com dois baldes de fichas: um para
+    requisições por minuto e outro para tokens por minuto.\n
+    Quem não pode ser atendido aguarda em uma fila sem fazer polling: um único timer é
+    agendado para o instante exato em que o próximo da fila pode seguir. A fila é
+    ordenada por prioridade e, dentro da mesma prioridade, os clientes são atendidos em
+    rodízio (cada cliente em ordem FIFO), para que uma requisição grande não monopolize
+    a cota. Sinais de 429/Retry-After do provedor pausam a fila inteira via `penalize`.
+    Os baldes ficam em `quota`: por padrão na memória do processo; com SQLiteQuota, a
+    mesma cota é dividida entre todos os processos e a fila local decide só a ordem; as
+    reservas são então feitas uma de cada vez por uma task de despacho, em threads.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, burst=None, name="rate-limiter", quota=None):
+        self.name = name
+        self.quota = quota or LocalQuota(requests_per_minute, tokens_per_minute, burst)
+        self._queues = {}
+        self._timer = None
+        self._timer_loop = None
+        self._dispatcher = None
+        self._redispatch = False
+
+        self.granted = 0
+        self.penalties = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=1000)
+        self._wait_histogram = rate_limiter_wait_seconds.labels(name)
+        rate_limiter_queue_depth.labels(name).set_function(self._queue_depth)
+
+    def _queue_depth(self):
+        return sum(len(waiters) for clients in self._queues.values() for waiters in clients.values())
+
+    def _next_waiter(self):
+        """Primeiro da fila: menor prioridade e, nela, o próximo cliente do rodízio"""
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            for client_id, waiters in clients.items():
+                if waiters:
+                    return priority, client_id, waiters[0]
+        return None
+
+    def _pop(self, priority, client_id):
+        clients = self._queues[priority]
+        waiters = clients[client_id]
+        waiters.popleft()
+        # O cliente atendido vai para o fim do rodízio
+        del clients[client_id]
+        if waiters:
+            clients[client_id] = waiters
+        if not clients:
+            del self._queues[priority]
+
+    def _remove(self, waiter, priority):
+        clients = self._queues.get(priority)
+        if not clients or waiter.client_id not in clients:
+            return
+        waiters = clients[waiter.client_id]
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        if not waiters:
+            del clients[waiter.client_id]
+        if not clients:
+            del self._queues[priority]
+
+    def _dispatch(self):
+        self._timer = None
+        loop = asyncio.get_running_loop()
+
+        if self.quota.blocking:
+            # Com uma reserva em andamento, a task de despacho revê a fila ao terminá-la
+            self._redispatch = True
+            if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+                self._dispatcher = loop.create_task(self._dispatch_blocking())
+            return
+
+        while True:
+            head = self._next_waiter()
+            if head is None:
+                return
+            priority, client_id, waiter = head
+
+            if waiter.future.done():
+                # Cancelado enquanto esperava
+                self._pop(priority, client_id)
+                continue
+
+            # Com cota compartilhada, outro processo pode ter gasto as fichas antes do timer
+            # disparar; nesse caso a reserva devolve uma nova espera e o timer é reagendado
+            delay = self.quota.reserve(waiter.tokens)
+            if delay > 0:
+                self._timer = loop.call_later(delay, self._dispatch)
+                self._timer_loop = loop
+                return
+
+            self._pop(priority, client_id)
+            self._record_wait(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    async def _dispatch_blocking(self):
+        """Versão de `_dispatch` para cotas que bloqueiam: cada reserva roda em uma thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._redispatch = False
+            head = self._next_waiter()
+            if head is None:
+                return
+            priority, client_id, waiter = head
+
+            if waiter.future.done():
+                self._pop(priority, client_id)
+                continue
+
+            delay = await asyncio.to_thread(self.quota.reserve, waiter.tokens)
+            if waiter.future.done():
+                # Cancelado durante a reserva (já saiu da fila): a cota volta para os próximos
+                if delay <= 0:
+                    await asyncio.to_thread(self.quota.refund, waiter.tokens)
+                continue
+            if delay > 0:
+                if self._redispatch:
+                    # A fila ou a cota mudou durante a reserva (ex.: tokens devolvidos)
+                    continue
+                self._timer = loop.call_later(delay, self._dispatch)
+                self._timer_loop = loop
+                return
+
+            self._pop(priority, client_id)
+            self._record_wait(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    async def _quota_call(self, method, *args):
+        """Chama uma operação da cota, em uma thread se ela bloquear"""
+        if self.quota.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _waiting(self):
+        """Há alguém aguardando um timer ou uma reserva em andamento"""
+        return self._timer is not None or (self._dispatcher is not None and not self._dispatcher.done())
+
+    def _schedule_dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    def _record_wait(self, wait):
+        self._wait_histogram.observe(wait)
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._recent_waits.append(wait)
+
+    async def acquire(self, tokens=1, client_id=None, priority=None):
+        """
+        Aguarda (sem bloquear o event loop) até haver cota para uma requisição de `tokens` tokens.\n
+        Se `client_id`/`priority` não forem informados, usa os valores do contexto da requisição.
+        """
+        client_id = client_id or current_client_id.get()
+        priority = current_priority.get() if priority is None else priority
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), tokens, client_id, time.monotonic())
+        self._queues.setdefault(priority, OrderedDict()).setdefault(client_id, deque()).append(waiter)
+
+        # Com um timer já agendado, quem chega espera a vez dele; um timer de outro event
+        # loop (ex.: asyncio.run anterior em scripts) não dispara mais e é descartado
+        if self._timer is None or self._timer_loop is not loop:
+            self._dispatch()
+        if waiter.future.done():
+            return
+
+        logger.debug(f"[{self.name}] Aguardando cota (fila: {self._queue_depth()}, cliente: {client_id})")
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._remove(waiter, priority)
+            raise
+
+    async def adjust(self, tokens):
+        """
+        Acerta o balde de tokens depois da chamada: `tokens` é a diferença entre o uso real
+        informado pelo provedor e a estimativa reservada em `acquire` (negativa devolve cota).
+        """
+        if tokens:
+            await self._quota_call(self.quota.adjust, tokens)
+            if tokens < 0 and self._waiting():
+                self._schedule_dispatch()
+
+    async def penalize(self, retry_after):
+        """Pausa toda a fila por `retry_after` segundos (resposta 429 ou cabeçalho Retry-After)"""
+        self.penalties += 1
+        await self._quota_call(self.quota.block, retry_after)
+        logger.warning(f"[{self.name}] Provedor pediu para aguardar {retry_after:.1f}s; fila pausada")
+        if self._waiting():
+            self._schedule_dispatch()
+
+    def stats(self):
+        recent = sorted(self._recent_waits)
+        return {
+            "backend": "sqlite" if isinstance(self.quota, SQLiteQuota) else "memory",
+            "queue_depth": self._queue_depth(),
+            "granted": self.granted,
+            "penalties": self.penalties,
+            "wait_seconds": {
+                "average": self.total_wait / self.granted if self.granted else 0.0,
+                "max": self.max_wait,
+                "p50": recent[int(len(recent) * 0.50)] if recent else 0.0,
+                "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+            },
+            **self.quota.snapshot(),
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import httpx
+
+from metrics import circuit_state, circuit_rejections_total, hedged_requests_total
+from deadline import budget_exhausted, wait_within
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker: abre quando a taxa de falhas na janela passa do limite (com um mínimo de
+# chamadas para decidir) e, depois de CIRCUIT_OPEN_SECONDS, deixa passar chamadas de teste
+CIRCUIT_FAILURE_RATE_THRESHOLD = float(os.getenv("CIRCUIT_FAILURE_RATE_THRESHOLD", 0.5))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 10))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", 30.0))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 15.0))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+# Prazo total de uma chamada ao Gemini (espera no rate limiter + tentativas + backoff)
+GEMINI_CALL_DEADLINE_SECONDS = float(os.getenv("GEMINI_CALL_DEADLINE_SECONDS", 45.0))
+# Prazo de uma chamada de sentimento à NLPCloud (incluindo a tentativa paralela, se houver)
+NLPCLOUD_CALL_DEADLINE_SECONDS = float(os.getenv("NLPCLOUD_CALL_DEADLINE_SECONDS", 10.0))
+
+# Hedging da NLPCloud: se a resposta demorar mais que o percentil configurado das latências
+# recentes, uma segunda chamada idêntica é disparada e vale a que responder primeiro
+NLPCLOUD_HEDGE_ENABLED = os.getenv("NLPCLOUD_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+NLPCLOUD_HEDGE_QUANTILE = float(os.getenv("NLPCLOUD_HEDGE_QUANTILE", 0.95))
+NLPCLOUD_HEDGE_MIN_DELAY = float(os.getenv("NLPCLOUD_HEDGE_MIN_DELAY", 0.05))
+# Amostras de latência necessárias antes de começar a disparar chamadas paralelas
+NLPCLOUD_HEDGE_MIN_SAMPLES = int(os.getenv("NLPCLOUD_HEDGE_MIN_SAMPLES", 20))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada sem tentar o provedor porque o circuito está aberto"""
+
+
+def is_provider_failure(error):
+    """
+    Indica se o erro mostra que o provedor está com problemas (5xx, timeout ou falha de rede).\n
+    Erros 4xx (inclusive 429, tratado pelo rate limiter) e respostas inválidas não contam.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por provedor, com janela deslizante de resultados.\n
+    Fechado: as chamadas passam e os resultados entram na janela. Quando a taxa de falhas
+    passa de `failure_rate_threshold` (com pelo menos `minimum_calls` chamadas), o circuito
+    abre e as chamadas falham na hora com CircuitOpenError, caindo direto nos fallbacks.
+    Após `open_seconds`, fica meio-aberto: até `half_open_probes` chamadas de teste passam;
+    um sucesso fecha o circuito e uma falha o abre de novo.
+    """
+
+    def __init__(self, name, failure_rate_threshold=CIRCUIT_FAILURE_RATE_THRESHOLD, minimum_calls=CIRCUIT_MIN_CALLS,
+                 window_seconds=CIRCUIT_WINDOW_SECONDS, open_seconds=CIRCUIT_OPEN_SECONDS,
+                 half_open_probes=CIRCUIT_HALF_OPEN_PROBES, is_failure=is_provider_failure):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.is_failure = is_failure
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._results = deque()
+        self._failures = 0
+        self._probes = 0
+        circuit_state.labels(name).set_function(lambda: _STATE_VALUES[self.state])
+
+    def _trim(self, now):
+        while self._results and now - self._results[0][0] > self.window_seconds:
+            _, failed = self._results.popleft()
+            self._failures -= failed
+
+    def failure_rate(self):
+        self._trim(time.monotonic())
+        return self._failures / len(self._results) if self._results else 0.0
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._results.clear()
+        self._failures = 0
+        logger.warning(f"[{self.name}] Circuito aberto por {self.open_seconds:g}s; usando fallbacks")
+
+    def check(self):
+        """Levanta CircuitOpenError se o circuito estiver aberto, sem reservar passagem"""
+        if self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds:
+            self.rejected += 1
+            circuit_rejections_total.labels(self.name).inc()
+            raise CircuitOpenError(f"Circuito de {self.name} aberto")
+
+    def before_call(self):
+        """Reserva a passagem de uma chamada ou levanta CircuitOpenError"""
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"[{self.name}] Circuito meio-aberto; testando o provedor")
+
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probes >= self.half_open_probes):
+            self.rejected += 1
+            circuit_rejections_total.labels(self.name).inc()
+            raise CircuitOpenError(f"Circuito de {self.name} aberto")
+        if self.state == HALF_OPEN:
+            self._probes += 1
+
+    def record(self, failed):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open(now)
+            else:
+                self.state = CLOSED
+                logger.info(f"[{self.name}] Circuito fechado; provedor recuperado")
+            return
+        if self.state == OPEN:
+            return
+
+        self._results.append((now, failed))
+        self._failures += failed
+        self._trim(now)
+        if (len(self._results) >= self.minimum_calls
+                and self._failures / len(self._results) >= self.failure_rate_threshold):
+            self._open(now)
+
+    def release(self):
+        """Libera a reserva de uma chamada que terminou sem veredito (ex.: cancelada)"""
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    async def call(self, coroutine_function, *args, timeout=None, **kwargs):
+        """
+        Executa a chamada protegida pelo circuito, com prazo opcional em segundos, limitada
+        também pelo prazo da requisição em vigor (ver deadline.wait_within)
+        """
+        self.before_call()
+        try:
+            result = await wait_within(timeout, coroutine_function, *args, **kwargs)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        except Exception as e:
+            # Um timeout causado pelo fim do prazo da requisição não diz nada sobre o provedor
+            if self.is_failure(e) and not (isinstance(e, asyncio.TimeoutError) and budget_exhausted()):
+                self.record(True)
+            else:
+                self.release()
+            raise
+        self.record(False)
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failure_rate": self.failure_rate(),
+            "calls_in_window": len(self._results),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Latências recentes de um provedor, usadas para decidir quando disparar o hedge"""
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, fraction):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+async def hedged(name, coroutine_function, *args, delay):
+    """
+    Executa `coroutine_function(*args)` e, se não terminar em `delay` segundos, dispara uma
+    segunda tentativa idêntica; devolve o primeiro sucesso e cancela a outra.\n
+    Com `delay` None a chamada é feita uma única vez.
+    """
+    if delay is None:
+        return await coroutine_function(*args)
+
+    first = asyncio.ensure_future(coroutine_function(*args))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            hedged_requests_total.labels(name, "fired").inc()
+            tasks.add(asyncio.ensure_future(coroutine_function(*args)))
+
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        hedged_requests_total.labels(name, "won").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# Instâncias compartilhadas, uma por provedor
+gemini_breaker = CircuitBreaker("gemini")
+nlpcloud_breaker = CircuitBreaker("nlpcloud")
+nlpcloud_latency = LatencyTracker()
+
+
+def nlpcloud_hedge_delay():
+    """Atraso até a tentativa paralela na NLPCloud, ou None se o hedging não deve ser usado"""
+    if not NLPCLOUD_HEDGE_ENABLED or len(nlpcloud_latency) < NLPCLOUD_HEDGE_MIN_SAMPLES:
+        return None
+    return max(NLPCLOUD_HEDGE_MIN_DELAY, nlpcloud_latency.quantile(NLPCLOUD_HEDGE_QUANTILE))
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from clients import get_clients, NLPCLOUD_MODEL
+from metrics import nlpcloud_request_seconds
+from resilience import (
+    nlpcloud_breaker, nlpcloud_latency, nlpcloud_hedge_delay, hedged, NLPCLOUD_CALL_DEADLINE_SECONDS
+)
+from deadline import check_deadline
+
+logger = logging.getLogger(__name__)
+
+# "nlpcloud" (padrão) usa a API remota; "local" roda um modelo transformers na CPU
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "nlpcloud")
+LOCAL_SENTIMENT_MODEL = os.getenv("LOCAL_SENTIMENT_MODEL", "cardiffnlp/twitter-xlm-roberta-base-sentiment")
+LOCAL_SENTIMENT_BATCH_SIZE = int(os.getenv("LOCAL_SENTIMENT_BATCH_SIZE", 32))
+LOCAL_SENTIMENT_MAX_LENGTH = int(os.getenv("LOCAL_SENTIMENT_MAX_LENGTH", 256))
+LOCAL_SENTIMENT_THREADS = int(os.getenv("LOCAL_SENTIMENT_THREADS", 0))
+# "torch" (padrão), "quantized" (quantização dinâmica int8) ou "onnx" (requer optimum[onnxruntime])
+LOCAL_SENTIMENT_RUNTIME = os.getenv("LOCAL_SENTIMENT_RUNTIME", "torch")
+# Textos por lote enviado à NLPCloud; a API aceita um texto por chamada, então cada lote
+# vira chamadas simultâneas sobre o pool de conexões compartilhado
+NLPCLOUD_BATCH_SIZE = int(os.getenv("NLPCLOUD_BATCH_SIZE", 8))
+
+
+class NLPCloudSentimentBackend:
+    """
+    Análise de sentimento pela API da NLPCloud, uma chamada HTTP por texto.\n
+    Cada chamada passa pelo circuit breaker da NLPCloud, tem prazo de
+    NLPCLOUD_CALL_DEADLINE_SECONDS e, com NLPCLOUD_HEDGE_ENABLED, ganha uma segunda
+    tentativa paralela quando passa do p95 das latências recentes.
+    """
+    name = "nlpcloud"
+    model = NLPCLOUD_MODEL
+    max_batch_size = NLPCLOUD_BATCH_SIZE
+    # Um lote vira chamadas simultâneas: esperar para juntar mais textos não economiza nada
+    native_batching = False
+
+    def load(self):
+        pass
+
+    async def _request(self, text):
+        start_time = time.perf_counter()
+        try:
+            response = await get_clients().sentiment(text)
+        except Exception:
+            nlpcloud_request_seconds.labels("error").observe(time.perf_counter() - start_time)
+            raise
+        latency = time.perf_counter() - start_time
+        nlpcloud_request_seconds.labels("ok").observe(latency)
+        nlpcloud_latency.add(latency)
+        return response
+
+    async def analyze(self, text):
+        check_deadline()
+        return await nlpcloud_breaker.call(
+            hedged, "nlpcloud", self._request, text,
+            delay=nlpcloud_hedge_delay(), timeout=NLPCLOUD_CALL_DEADLINE_SECONDS,
+        )
+
+    async def analyze_batch(self, texts):
+        # Falhas individuais voltam como exceções na posição do texto, sem derrubar o lote
+        return await asyncio.gather(*(self.analyze(text) for text in texts), return_exceptions=True)
+
+
+class LocalSentimentBackend:
+    """
+    Análise de sentimento com um modelo transformers rodando localmente na CPU.\n
+    O modelo é carregado uma única vez (no startup) e todos os textos de uma requisição
+    passam juntos pelo modelo: são ordenados por tamanho e agrupados em lotes com padding
+    dinâmico (só até o maior texto do lote), o que reduz o custo de cada forward pass.
+    As respostas seguem o formato da NLPCloud ({"scored_labels": [...]}) para que o
+    restante do código não precise saber qual backend está em uso.
+    """
+    name = "local"
+    # Textos de várias requisições no mesmo forward pass custam quase o mesmo que um só
+    native_batching = True
+
+    def __init__(self, model_name=LOCAL_SENTIMENT_MODEL, runtime=LOCAL_SENTIMENT_RUNTIME,
+                 batch_size=LOCAL_SENTIMENT_BATCH_SIZE, max_length=LOCAL_SENTIMENT_MAX_LENGTH):
+        self.model = model_name
+        self.runtime = runtime
+        self.batch_size = batch_size
+        self.max_batch_size = batch_size
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._labels = None
+        self._load_lock = threading.Lock()
+        # Um forward pass por vez: o torch já paraleliza internamente entre os núcleos
+        self._inference_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self._model is not None:
+                return
+
+            logger.info(f"Carregando modelo local de sentimento {self.model} (runtime: {self.runtime})")
+            start_time = time.time()
+
+            # Imports pesados feitos só quando o backend local é realmente usado
+            import torch
+            from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+            if LOCAL_SENTIMENT_THREADS:
+                torch.set_num_threads(LOCAL_SENTIMENT_THREADS)
+
+            tokenizer = AutoTokenizer.from_pretrained(self.model)
+            if self.runtime == "onnx":
+                try:
+                    from optimum.onnxruntime import ORTModelForSequenceClassification
+                except ImportError as e:
+                    raise RuntimeError(
+                        "LOCAL_SENTIMENT_RUNTIME=onnx requer o pacote optimum[onnxruntime]"
+                    ) from e
+                model = ORTModelForSequenceClassification.from_pretrained(self.model, export=True)
+            else:
+                model = AutoModelForSequenceClassification.from_pretrained(self.model)
+                model.eval()
+                if self.runtime == "quantized":
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            self._labels = {int(index): label.upper() for index, label in model.config.id2label.items()}
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info(f"Modelo local de sentimento carregado em {time.time() - start_time:.2f} segundos")
+
+    def predict(self, texts):
+        """Classifica os textos de forma síncrona (chamar fora do event loop)"""
+        import torch
+
+        self.load()
+        results = [None] * len(texts)
+        # Ordenar por tamanho deixa textos parecidos no mesmo lote e minimiza o padding
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+
+        with self._inference_lock, torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                chunk = order[start:start + self.batch_size]
+                inputs = self._tokenizer(
+                    [texts[index] for index in chunk],
+                    padding="longest",
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                )
+                logits = self._model(**inputs).logits
+                scores, label_ids = torch.softmax(logits, dim=-1).max(dim=-1)
+                for index, score, label_id in zip(chunk, scores.tolist(), label_ids.tolist()):
+                    results[index] = {"scored_labels": [{"label": self._labels[label_id], "score": score}]}
+        return results
+
+    async def analyze(self, text):
+        return (await self.analyze_batch([text]))[0]
+
+    async def analyze_batch(self, texts):
+        return await asyncio.to_thread(self.predict, texts)
+
+
+_backend = None
+
+
+def get_sentiment_backend():
+    """Devolve o backend de sentimento configurado em SENTIMENT_BACKEND (criado uma única vez)"""
+    global _backend
+    if _backend is None:
+        _backend = LocalSentimentBackend() if SENTIMENT_BACKEND == "local" else NLPCloudSentimentBackend()
+        logger.info(f"Backend de análise de sentimento: {_backend.name}")
+    return _backend
@@ -1,25 +1,33 @@
-from google import genai
+from clients import get_clients, GEMINI_MODEL
 import os
-from nlpcloud import Client
-from os.path import join, dirname
-from dotenv import load_dotenv
 import logging
 import time
-import json
 import random
-import threading
+import asyncio
+import contextlib
+from email.utils import parsedate_to_datetime
+from rate_limiter import RateLimitScheduler, create_quota
+from prompts import estimate_tokens
+from batching import MicroBatcher
+from sentiment_backends import get_sentiment_backend
+from cache import normalize_message
+from singleflight import SingleFlight
+from resilience import gemini_breaker, CircuitOpenError, GEMINI_CALL_DEADLINE_SECONDS
+from deadline import time_left, check_deadline, wait_within
+from metrics import gemini_request_seconds, gemini_retries_total, gemini_tokens_total, sentiment_batch_seconds
 
 logger = logging.getLogger(__name__)
 
-dotenv_path = join(dirname(__file__), '.env')
-load_dotenv(dotenv_path)
-logger.info("Variáveis de ambiente carregadas")
-
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
 NLP_API_KEY = os.getenv("NLPCLOUD_API_KEY")
 
 # Configurações para gerenciamento de rate limiting
 GEMINI_MAX_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_MAX_REQUESTS_PER_MINUTE", 5))
+GEMINI_MAX_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_MAX_TOKENS_PER_MINUTE", 250000))
+SENTIMENT_MAX_CONCURRENT_BATCHES = int(os.getenv("SENTIMENT_MAX_CONCURRENT_BATCHES", 4))
+# Espera máxima (ms) para juntar frases de requisições simultâneas em um lote do modelo local
+SENTIMENT_BATCH_MAX_WAIT_MS = float(os.getenv("SENTIMENT_BATCH_MAX_WAIT_MS", 5))
+GEMINI_RATE_LIMIT_BURST = int(os.getenv("GEMINI_RATE_LIMIT_BURST", GEMINI_MAX_REQUESTS_PER_MINUTE))
 GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 3))
 GEMINI_RETRY_DELAY_BASE = float(os.getenv("GEMINI_RETRY_DELAY_BASE", 2.0))
 
@@ -28,142 +36,252 @@ if not GEMINI_API_KEY:
 if not NLP_API_KEY:
     logger.warning("NLP_API_KEY não encontrada nas variáveis de ambiente")
 
-# Lock para controlar concorrência nas chamadas do Gemini
-gemini_lock = threading.Lock()
-gemini_last_request_time = 0
-gemini_request_count = 0
-gemini_request_window_start = 0
+# Coalescência das análises de sentimento em andamento: a mesma frase (normalizada) pedida
+# por requisições simultâneas gera uma única chamada ao backend
+sentiment_flights = SingleFlight("sentiment")
+
+# Escalonador de rate limiting do Gemini: balde de requisições e balde de tokens por minuto.
+# Com RATE_LIMIT_BACKEND=sqlite os baldes são compartilhados por todos os processos, e os
+# limites acima valem para a aplicação inteira, não para cada worker
+gemini_rate_limiter = RateLimitScheduler(
+    GEMINI_MAX_REQUESTS_PER_MINUTE,
+    GEMINI_MAX_TOKENS_PER_MINUTE,
+    burst=GEMINI_RATE_LIMIT_BURST,
+    name="gemini",
+    quota=create_quota("gemini", GEMINI_MAX_REQUESTS_PER_MINUTE, GEMINI_MAX_TOKENS_PER_MINUTE, GEMINI_RATE_LIMIT_BURST),
+)
 
-def reset_gemini_rate_limit_window():
-    """Reset a janela de contagem de requests do Gemini se necessário"""
-    global gemini_request_window_start, gemini_request_count
-    current_time = time.time()
-    
-    # Se já passou mais de um minuto desde o início da janela atual
-    if current_time - gemini_request_window_start >= 60:
-        gemini_request_window_start = current_time
-        gemini_request_count = 0
-        logger.debug("Janela de rate limiting do Gemini reiniciada")
-
-def can_make_gemini_request():
-    """Verifica se podemos fazer uma nova request para o Gemini dentro do rate limit"""
-    global gemini_request_count, gemini_request_window_start
-    
-    with gemini_lock:
-        current_time = time.time()
-        
-        # Inicializa a janela se for a primeira request
-        if gemini_request_window_start == 0:
-            gemini_request_window_start = current_time
-            gemini_request_count = 0
-            return True
-        
-        # Verifica se precisamos reiniciar a janela
-        reset_gemini_rate_limit_window()
-        
-        # Verifica se estamos dentro do limite
-        if gemini_request_count < GEMINI_MAX_REQUESTS_PER_MINUTE:
-            gemini_request_count += 1
-            logger.debug(f"Request Gemini permitida: {gemini_request_count}/{GEMINI_MAX_REQUESTS_PER_MINUTE} na janela atual")
-            return True
-        else:
-            time_until_reset = 60 - (current_time - gemini_request_window_start)
-            logger.warning(f"Rate limit do Gemini atingido. Próxima janela em {time_until_reset:.1f}s")
-            return False
 
-def create_juice(message_text, prompt, cache_key=None):
+def retry_after_seconds(error):
     """
-    Gera conteúdo usando a API Gemini com suporte para rate limiting e retry
+    Extrai o tempo de espera pedido pelo provedor em uma resposta 429/503:
+    cabeçalho Retry-After (segundos ou data HTTP) ou o campo retryDelay do corpo do Gemini.
+    """
+    response = getattr(error, "response", None)
+    if response is None or response.status_code not in (429, 503):
+        return None
+
+    header = response.headers.get("retry-after")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    try:
+        for detail in response.json().get("error", {}).get("details", []):
+            if "retryDelay" in detail:
+                return float(detail["retryDelay"].rstrip("s"))
+    except Exception:
+        pass
+
+    return GEMINI_RETRY_DELAY_BASE
+
+async def create_juice(contents, cache_key=None, generation_config=None, kind="generic", call_slot=None):
+    """
+    Gera conteúdo usando a API Gemini com suporte para rate limiting e retry.
+    A chamada usa o cliente HTTP assíncrono compartilhado e as esperas usam
+    asyncio.sleep, de modo que o event loop do uvicorn nunca fica bloqueado.
     
     Args:
-        message_text: Texto da mensagem para análise
-        prompt: Prompt para o modelo Gemini
-        cache_key: Parâmetro mantido para compatibilidade, mas não utilizado
+        contents: Prompt completo, já com a mensagem (ver prompts.PromptTemplate.render)
+        cache_key: Chave do cache de resultados (ver cache.make_cache_key), usada apenas nos logs;
+            a consulta e a gravação no cache são feitas por quem chama
+        generation_config: Configuração opcional de geração do Gemini (ex.: responseMimeType e
+            responseSchema para forçar uma saída JSON estruturada)
+        kind: Tipo do prompt ("process", "poem", "combined", "batch"), usado como label nas métricas
+        call_slot: Fábrica opcional de um context manager assíncrono que limita as chamadas
+            simultâneas; a vaga é ocupada só durante a chamada HTTP, depois de obtida a cota,
+            para que a espera no escalonador não segure vagas de outros clientes
     
     Returns:
         Resposta da API Gemini
     """
-    logger.info(f"Gerando conteúdo com Gemini API: mensagem de {len(message_text)} caracteres")
-    start_time = time.time()
+    estimated_tokens = estimate_tokens(contents)
+    logger.debug(f"Gerando conteúdo com Gemini API: prompt de ~{estimated_tokens} tokens (chave: {cache_key})")
     
-    # Implementação de retry com backoff exponencial
+    # Implementação de retry com backoff exponencial, limitada pelo prazo total da chamada
+    # e pelo que resta do prazo da requisição (o que for menor). O prazo da requisição é
+    # relido a cada espera: ele pode ser estendido durante a chamada (ver SingleFlight)
+    check_deadline()
     retry_count = 0
     last_exception = None
+    loop = asyncio.get_running_loop()
+    call_deadline = loop.time() + GEMINI_CALL_DEADLINE_SECONDS
     
     while retry_count <= GEMINI_MAX_RETRIES:
         try:
-            # Verifica se podemos fazer uma nova requisição (rate limiting)
-            wait_time = 0
-            while not can_make_gemini_request():
-                wait_time = random.uniform(1, 3)  # Adiciona um pouco de jitter
-                logger.info(f"Aguardando {wait_time:.1f}s antes de nova tentativa (rate limiting)")
-                time.sleep(wait_time)
+            # Com o circuito aberto não vale a pena nem esperar cota: cai direto no fallback
+            gemini_breaker.check()
+            
+            # Aguarda cota no escalonador (rate limiting); a espera é feita sem polling
+            await wait_within(call_deadline - loop.time(), gemini_rate_limiter.acquire, estimated_tokens)
             
             # Faz a chamada para a API
             logger.debug(f"Fazendo requisição para API Gemini (tentativa {retry_count + 1}/{GEMINI_MAX_RETRIES + 1})")
-            client = genai.Client(api_key=GEMINI_API_KEY)
-            response = client.models.generate_content(
-                model="gemini-2.5-flash", 
-                contents=f"{prompt}: {message_text}"
-            )
-            
-            end_time = time.time()
-            logger.info(f"Resposta do Gemini recebida em {end_time - start_time:.2f} segundos")
+            async with (call_slot or contextlib.nullcontext)():
+                response = await gemini_breaker.call(
+                    _generate_once, contents, generation_config, kind, timeout=call_deadline - loop.time()
+                )
+            # O balde de tokens reservou a estimativa; acerta a diferença com o uso real informado
+            prompt_tokens = response.usage.get("promptTokenCount")
+            if prompt_tokens:
+                await gemini_rate_limiter.adjust(prompt_tokens - estimated_tokens)
             return response
         
+        except CircuitOpenError:
+            logger.warning(f"Circuito do Gemini aberto; chamada {kind} não realizada")
+            raise
         except Exception as e:
             last_exception = e
             retry_count += 1
+            remaining = time_left(call_deadline - loop.time())
             
-            if retry_count <= GEMINI_MAX_RETRIES:
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                # O provedor sinalizou sobrecarga: pausa a fila inteira do escalonador em vez
+                # de só esta chamada, e a próxima tentativa espera a vez dela em acquire()
+                await gemini_rate_limiter.penalize(retry_after)
+                delay = retry_after
+            else:
                 # Calcula tempo de espera com backoff exponencial e jitter
                 delay = GEMINI_RETRY_DELAY_BASE ** retry_count + random.uniform(0, 1)
-                logger.warning(f"Erro na chamada à API Gemini: {str(e)}. Tentativa {retry_count}/{GEMINI_MAX_RETRIES}. Aguardando {delay:.1f}s.")
-                time.sleep(delay)
-            else:
+            
+            if retry_count > GEMINI_MAX_RETRIES:
                 logger.error(f"Todas as tentativas falharam para chamada Gemini. Último erro: {str(e)}")
                 raise last_exception
+            if delay >= remaining:
+                logger.error(
+                    f"Prazo da chamada Gemini esgotado "
+                    f"após {retry_count} tentativa(s). Último erro: {str(e)}"
+                )
+                raise last_exception
+            
+            gemini_retries_total.labels(kind, "rate_limited" if retry_after is not None else "error").inc()
+            if retry_after is not None:
+                logger.warning(f"Gemini respondeu {e.response.status_code}. Tentativa {retry_count}/{GEMINI_MAX_RETRIES}.")
+            else:
+                logger.warning(f"Erro na chamada à API Gemini: {str(e)}. Tentativa {retry_count}/{GEMINI_MAX_RETRIES}. Aguardando {delay:.1f}s.")
+                await asyncio.sleep(delay)
     
     # Se chegamos aqui, todas as tentativas falharam
     logger.error(f"Falha após {GEMINI_MAX_RETRIES} tentativas. Último erro: {str(last_exception)}")
     raise last_exception
 
-# Função para analisar o sentimento de uma frase
-def analyze_phrase(phrase: str):
-    logger.info(f"Analisando sentimento da frase: '{phrase[:50]}...' (tamanho: {len(phrase)} caracteres)")
-    start_time = time.time()
-    
+
+async def _generate_once(contents, generation_config, kind):
+    """Uma única chamada ao Gemini, com a latência registrada nas métricas"""
+    call_start = time.perf_counter()
     try:
-        # Usa a API da NLP Cloud para fazer a análise de sentimentos na nuvem
-        analyst = Client("finetuned-llama-3-70b", token=NLP_API_KEY, gpu=True)
-        response = analyst.sentiment(phrase)
-        
-        logger.debug(f"Resposta bruta da API NLPCloud: {response}")
-        
-        # Adapta a resposta da API para o formato esperado pelo restante do código
-        # O formato anterior esperava uma lista onde cada item tem 'label' e 'score',
-        # pois estávamos usando um transformador local
-        formatted_response = []
-        
-        if "scored_labels" in response:
-            item = response["scored_labels"][0]
-            formatted_response.append({
-                "label": item["label"],
-                "score": item["score"]
-            })
-            logger.info(f"Sentimento detectado: {item['label']} com score {item['score']}")
-        else:
-            logger.warning("Formato de resposta inesperado da API NLPCloud, usando fallback")
-            formatted_response.append({
-                "label": "UNDEFINED",
-                "score": 0.0
-            })
-        
-        end_time = time.time()
-        logger.info(f"Análise de sentimento concluída em {end_time - start_time:.2f} segundos")
-        
-        return formatted_response
+        response = await get_clients().generate(
+            contents,
+            model=GEMINI_MODEL,
+            generation_config=generation_config,
+        )
+    except Exception as e:
+        outcome = "rate_limited" if retry_after_seconds(e) is not None else "error"
+        gemini_request_seconds.labels(kind, outcome).observe(time.perf_counter() - call_start)
+        raise
+    gemini_request_seconds.labels(kind, "ok").observe(time.perf_counter() - call_start)
+    usage = response.usage
+    gemini_tokens_total.labels(kind, "input").inc(usage.get("promptTokenCount", 0))
+    gemini_tokens_total.labels(kind, "output").inc(usage.get("candidatesTokenCount", 0))
+    logger.debug(
+        f"Uso do Gemini ({kind}): {usage.get('promptTokenCount', '?')} tokens de entrada, "
+        f"{usage.get('candidatesTokenCount', '?')} de saída"
+    )
+    return response
+
+def format_sentiment_response(response):
+    """
+    Adapta a resposta do backend de sentimento para o formato esperado pelo restante do código:
+    uma lista onde cada item tem 'label' e 'score'
+    """
+    if "scored_labels" in response:
+        item = response["scored_labels"][0]
+        logger.debug(f"Sentimento detectado: {item['label']} com score {item['score']}")
+        return [{
+            "label": item["label"],
+            "score": item["score"]
+        }]
+
+    logger.warning("Formato de resposta inesperado do backend de sentimento, usando fallback")
+    return [{
+        "label": "UNDEFINED",
+        "score": 0.0
+    }]
+
+
+async def _analyze_batch(phrases):
+    """
+    Uma chamada em lote ao backend configurado (API da NLPCloud com o pool de conexões
+    compartilhado, ou o modelo local carregado no startup). Um lote que falhar recebe o
+    fallback de erro sem afetar os demais.
+    """
+    backend = get_sentiment_backend()
+    batch_start = time.perf_counter()
+    try:
+        responses = await backend.analyze_batch(phrases)
     except Exception as e:
-        logger.error(f"Erro na análise de sentimento: {str(e)}")
-        # Retorna um fallback em caso de erro
-        return [{"label": "ERROR", "score": 0.0}]
+        logger.error(f"Erro na análise de sentimento em lote: {str(e)}")
+        return [[{"label": "ERROR", "score": 0.0}] for _ in phrases]
+    finally:
+        sentiment_batch_seconds.labels(backend.name).observe(time.perf_counter() - batch_start)
+
+    results = []
+    for response in responses:
+        if isinstance(response, Exception):
+            logger.error(f"Erro na análise de sentimento: {str(response)}")
+            results.append([{"label": "ERROR", "score": 0.0}])
+        else:
+            results.append(format_sentiment_response(response))
+    return results
+
+
+_sentiment_batcher = None
+
+
+def get_sentiment_batcher():
+    """
+    Agrupador das frases de todas as requisições em lotes do tamanho aceito pelo backend.\n
+    Só o modelo local ganha com a espera por mais frases; na NLPCloud (uma chamada por
+    texto) a janela é zero e o agrupador apenas limita os lotes simultâneos.
+    """
+    global _sentiment_batcher
+    if _sentiment_batcher is None:
+        backend = get_sentiment_backend()
+        _sentiment_batcher = MicroBatcher(
+            "sentiment",
+            _analyze_batch,
+            backend.max_batch_size,
+            SENTIMENT_BATCH_MAX_WAIT_MS / 1000 if backend.native_batching else 0.0,
+            max_concurrent_batches=SENTIMENT_MAX_CONCURRENT_BATCHES,
+        )
+    return _sentiment_batcher
+
+
+async def analyze_phrases(phrases):
+    """
+    Analisa o sentimento de várias frases de uma vez e devolve os resultados na ordem de `phrases`.\n
+    Frases idênticas (após normalização) são analisadas uma única vez; as frases únicas vão
+    para o agrupador (get_sentiment_batcher), que as divide em lotes do tamanho aceito pelo
+    backend, junto com as frases de outras requisições simultâneas.
+    Frases que já estão sendo analisadas por outra requisição aguardam aquele resultado.
+    """
+    unique_phrases = {}
+    for phrase in phrases:
+        unique_phrases.setdefault(normalize_message(phrase), phrase)
+
+    async def analyze_missing(keys):
+        # Só chegam aqui as frases que não estão sendo analisadas por outra requisição
+        logger.debug(
+            f"Analisando sentimento de {len(phrases)} frases em lote "
+            f"({len(unique_phrases)} únicas, {len(keys)} novas)"
+        )
+        return await get_sentiment_batcher().submit_many([unique_phrases[key] for key in keys])
+
+    results_by_key = await sentiment_flights.do_many(list(unique_phrases), analyze_missing)
+    return [results_by_key[normalize_message(phrase)] for phrase in phrases]
@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import copy
+import logging
+import math
+
+from deadline import current_deadline
+from metrics import singleflight_in_flight
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "deadline")
+
+    def __init__(self, task, deadline):
+        self.task = task
+        self.waiters = 0
+        self.deadline = deadline
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em andamento ("single-flight").\n
+    Enquanto uma chamada para uma chave está em andamento, quem pedir a mesma chave
+    aguarda o mesmo resultado em vez de disparar outra chamada ao provedor. A chamada roda
+    em uma task própria: se quem a iniciou for cancelado (ex.: cliente desconectou), os
+    demais continuam esperando; ela só é cancelada quando ninguém mais aguarda o resultado.
+    O prazo da chamada é o maior entre os de quem aguarda (nenhum, se alguém não tiver
+    prazo): o prazo de cada um limita só a própria espera, nunca a chamada compartilhada.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.executed = 0
+        self.shared = 0
+        self._flights = {}
+        singleflight_in_flight.labels(name).set_function(lambda: len(self._flights))
+
+    @staticmethod
+    def _own_deadline():
+        """Cópia do prazo de quem inicia a chamada, que cresce conforme outros se juntam a ela"""
+        deadline = current_deadline.get()
+        return copy.copy(deadline) if deadline is not None else None
+
+    @staticmethod
+    def _create_task(coroutine_function, args, deadline):
+        context = contextvars.copy_context()
+        context.run(current_deadline.set, deadline)
+        return asyncio.get_running_loop().create_task(coroutine_function(*args), context=context)
+
+    def _start(self, key, coroutine_function, *args, deadline=None):
+        flight = _Flight(self._create_task(coroutine_function, args, deadline), deadline)
+        self._flights[key] = flight
+        self.executed += 1
+
+        def forget(_):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight.task.add_done_callback(forget)
+        return flight
+
+    async def _wait(self, flight):
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _join(self, key):
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            if flight.deadline is not None:
+                deadline = current_deadline.get()
+                flight.deadline.expires_at = (
+                    math.inf if deadline is None else max(flight.deadline.expires_at, deadline.expires_at)
+                )
+            logger.debug(f"[{self.name}] Chamada em andamento reaproveitada para a chave {key[:12]}")
+        return flight
+
+    async def do(self, key, coroutine_function, *args):
+        """Executa `coroutine_function(*args)` uma única vez por chave entre chamadas simultâneas"""
+        flight = self._join(key) or self._start(key, coroutine_function, *args, deadline=self._own_deadline())
+        return await self._wait(flight)
+
+    async def do_many(self, keys, batch_function):
+        """
+        Versão em lote de `do`: `batch_function(chaves)` recebe apenas as chaves que não estão
+        em andamento e devolve os resultados na mesma ordem. Retorna um dicionário chave → resultado.
+        """
+        keys = list(dict.fromkeys(keys))
+        flights = {}
+        missing = []
+        for key in keys:
+            flight = self._join(key)
+            if flight is not None:
+                flights[key] = flight
+            else:
+                missing.append(key)
+
+        if missing:
+            # O lote e as chaves dele compartilham o mesmo prazo: quem se junta a qualquer
+            # uma das chaves estende o prazo do lote inteiro
+            deadline = self._own_deadline()
+            batch = self._create_task(batch_function, (missing,), deadline)
+            remaining = [len(missing)]
+
+            async def pick(index):
+                try:
+                    return (await asyncio.shield(batch))[index]
+                except asyncio.CancelledError:
+                    remaining[0] -= 1
+                    # O lote só é cancelado quando nenhuma das suas chaves tem mais interessados
+                    if remaining[0] == 0 and not batch.done():
+                        batch.cancel()
+                    raise
+
+            for index, key in enumerate(missing):
+                flights[key] = self._start(key, pick, index, deadline=deadline)
+            # Conta como uma única execução ao provedor
+            self.executed -= len(missing) - 1
+
+        results = await asyncio.gather(*(self._wait(flights[key]) for key in keys))
+        return dict(zip(keys, results))
+
+    def stats(self):
+        total = self.executed + self.shared
+        return {
+            "in_flight": len(self._flights),
+            "executed": self.executed,
+            "shared": self.shared,
+            "saved_ratio": self.shared / total if total else 0.0,
+        }
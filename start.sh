@@ -5,8 +5,25 @@
 
 # Definir a porta padrão se não estiver definida
 export PORT=${PORT:-8000}
+export JOBS_WORKERS=${JOBS_WORKERS:-1}
+# Processos do uvicorn atendendo a API (um por núcleo disponível é um bom ponto de partida)
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
 
-echo "Iniciando API de Análise de Sentimentos na porta $PORT"
+# A API e os workers de jobs são processos separados: a cota do Gemini precisa ser uma só
+# para todos eles, senão cada processo gasta o limite inteiro por conta própria
+export RATE_LIMIT_BACKEND=${RATE_LIMIT_BACKEND:-sqlite}
+# Com vários workers da API, o cache em disco evita que cada um refaça as mesmas análises
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    export CACHE_BACKEND=${CACHE_BACKEND:-sqlite}
+fi
+
+# Iniciar os workers da fila de jobs em segundo plano (compartilham o disco com a API)
+for i in $(seq 1 $JOBS_WORKERS); do
+    echo "Iniciando worker de jobs $i/$JOBS_WORKERS"
+    python worker.py &
+done
+
+echo "Iniciando API de Análise de Sentimentos na porta $PORT com $WEB_CONCURRENCY worker(s)"
 
 # Iniciar o servidor Uvicorn
-uvicorn main:app --host=0.0.0.0 --port=$PORT --log-level=info
+uvicorn main:app --host=0.0.0.0 --port=$PORT --workers=$WEB_CONCURRENCY --log-level=info
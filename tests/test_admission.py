@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AdmissionController, AdmissionRejected
+
+
+class AdmissionControllerTest(unittest.IsolatedAsyncioTestCase):
+    async def _queued(self, controller, client_id):
+        """Coloca `client_id` na fila e devolve a task que aguarda a vaga"""
+        task = asyncio.create_task(controller.acquire(client_id))
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        return task
+
+    async def test_full_queue_is_rejected_with_503(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5, max_per_client=0)
+        await controller.acquire("a")
+        waiting = await self._queued(controller, "b")
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await controller.acquire("c")
+        self.assertEqual((rejected.exception.status_code, rejected.exception.reason), (503, "queue_full"))
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+
+        # A vaga liberada passa direto para quem estava na fila
+        controller.release("a", 0.1)
+        await waiting
+        self.assertEqual(controller.stats()["in_flight"], 1)
+
+    async def test_queue_timeout_is_rejected_with_503(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.05, max_per_client=0)
+        await controller.acquire("a")
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await controller.acquire("b")
+        self.assertEqual((rejected.exception.status_code, rejected.exception.reason), (503, "queue_timeout"))
+        self.assertEqual(controller.stats()["queue_depth"], 0)
+
+    async def test_client_over_its_limit_is_rejected_with_429(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=8, queue_timeout=5, max_per_client=2)
+        await controller.acquire("a")
+        # O pedido na fila já conta para o limite do cliente
+        waiting = await self._queued(controller, "a")
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        self.assertEqual((rejected.exception.status_code, rejected.exception.reason), (429, "client_limit"))
+
+        # Outro cliente ainda consegue entrar na fila
+        other = await self._queued(controller, "b")
+        controller.release("a", 0.1)
+        await waiting
+        controller.release("a", 0.1)
+        await other
+        self.assertEqual(controller.stats()["rejected"], {"client_limit": 1})
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5, max_per_client=0)
+        await controller.acquire("a")
+        waiting = await self._queued(controller, "b")
+
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(controller.stats()["queue_depth"], 0)
+        self.assertEqual(controller.stats()["clients"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
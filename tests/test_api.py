@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+# Provedores falsos e sem cache: a API inteira roda offline
+os.environ.setdefault("PROVIDER_TRANSPORT", "fake")
+os.environ.setdefault("CACHE_BACKEND", "none")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import main
+import services
+from rate_limiter import RateLimitScheduler
+
+
+class AnalyzeEndpointTest(unittest.TestCase):
+    def setUp(self):
+        # Sem a espera do limite padrão de requisições por minuto do Gemini
+        limiter = RateLimitScheduler(6000, 10_000_000, name="test-api")
+        patcher = mock.patch.object(services, "gemini_rate_limiter", limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+    def test_analyze_returns_parsed_results_in_message_order(self):
+        messages = ["Adorei o atendimento", "Péssimo serviço", "Tudo certo"]
+        response = self.client.post("/analyze", json=[{"message": message} for message in messages])
+
+        self.assertEqual(response.status_code, 200, response.text)
+        analysis = response.json()["analysis"]
+        self.assertEqual([item["message_text"] for item in analysis["message_list"]], messages)
+        self.assertEqual(len(analysis["process_description"]), 3)
+        self.assertEqual(len(analysis["poem"]), 3)
+        # Objetos já decodificados no servidor, não JSON dentro de strings
+        self.assertIsInstance(analysis["poem"][0]["lines"], list)
+        self.assertIsInstance(analysis["process_description"][0]["steps"], list)
+
+    def test_analyze_rejects_invalid_body(self):
+        response = self.client.post("/analyze", json=[{"texto": "sem o campo message"}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"][0]["loc"], ["body", 0, "message"])
+
+    def test_ready_after_warmup(self):
+        # O aquecimento roda em segundo plano: /readyz passa a 200 quando ele termina
+        deadline = time.monotonic() + 5
+        while self.client.get("/readyz").status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(self.client.get("/readyz").status_code, 200)
+        self.assertEqual(self.client.get("/livez").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
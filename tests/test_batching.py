@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher
+
+
+class MicroBatcherTest(unittest.IsolatedAsyncioTestCase):
+    def _batcher(self, max_batch_size, max_wait, **kwargs):
+        self.sizes = []
+
+        async def double(values):
+            self.sizes.append(len(values))
+            return [value * 2 for value in values]
+
+        return MicroBatcher("test", double, max_batch_size, max_wait, **kwargs)
+
+    async def test_flushes_when_batch_is_full(self):
+        batcher = self._batcher(max_batch_size=3, max_wait=5)
+        await batcher.submit(0)
+        await asyncio.sleep(0.2)
+
+        # A janela prevista passa a ser de centenas de ms, mas o terceiro item completa o lote
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await asyncio.gather(*(batcher.submit(value) for value in (1, 2, 3)))
+
+        self.assertEqual(results, [2, 4, 6])
+        self.assertEqual(self.sizes, [1, 3])
+        self.assertLess(loop.time() - start, 0.1)
+
+    async def test_submit_many_splits_by_size(self):
+        batcher = self._batcher(max_batch_size=3, max_wait=5)
+
+        self.assertEqual(await batcher.submit_many(range(7)), [0, 2, 4, 6, 8, 10, 12])
+        self.assertEqual(self.sizes, [3, 3, 1])
+
+    async def test_flushes_partial_batch_when_window_ends(self):
+        batcher = self._batcher(max_batch_size=100, max_wait=0.1)
+        first = asyncio.create_task(batcher.submit(0))
+
+        async def later(value):
+            await asyncio.sleep(0.01 * value)
+            return await batcher.submit(value)
+
+        # Com tráfego leve o primeiro sai sozinho e na hora; os seguintes chegam a cada 10ms,
+        # aguardam a janela e saem juntos em um lote incompleto
+        results = await asyncio.gather(first, *(later(value) for value in range(1, 5)))
+
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(self.sizes, [1, 4])
+        self.assertEqual(batcher.stats()["pending"], 0)
+
+    async def test_cancelled_item_is_dropped_before_flush(self):
+        batcher = self._batcher(max_batch_size=100, max_wait=0.1)
+        kept = asyncio.create_task(batcher.submit(1))
+        dropped = asyncio.create_task(batcher.submit(2))
+        await asyncio.sleep(0)
+        dropped.cancel()
+
+        self.assertEqual(await kept, 2)
+        self.assertEqual(self.sizes, [1])
+        with self.assertRaises(asyncio.CancelledError):
+            await dropped
+
+    async def test_error_reaches_every_item(self):
+        async def broken(values):
+            raise RuntimeError("falha no lote")
+
+        batcher = MicroBatcher("test-error", broken, 10, 0.01)
+        results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+os.environ.setdefault("CACHE_BACKEND", "none")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import MemoryCache
+
+
+class MemoryCacheEvictionTest(unittest.TestCase):
+    def test_evicts_least_recently_used_by_entries(self):
+        cache = MemoryCache(max_entries=2, max_bytes=1024)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        # A leitura torna "a" a mais recente: quem sai é "b"
+        cache.get("a")
+        cache.set("c", "3")
+
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), ("1", None, "3"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_evicts_by_bytes(self):
+        # Cada entrada ocupa 1 byte de chave + 10 de valor
+        cache = MemoryCache(max_entries=100, max_bytes=25)
+        for key in "abc":
+            cache.set(key, "x" * 10)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 22)
+
+    def test_value_larger_than_limit_is_ignored(self):
+        cache = MemoryCache(max_entries=100, max_bytes=25)
+        cache.set("a", "x" * 10)
+        cache.set("b", "x" * 100)
+
+        self.assertEqual((cache.get("a"), cache.get("b")), ("x" * 10, None))
+        self.assertEqual(cache.stats()["evictions"], 0)
+
+    def test_overwrite_does_not_count_bytes_twice(self):
+        cache = MemoryCache(max_entries=100, max_bytes=25)
+        cache.set("a", "x" * 10)
+        cache.set("a", "y" * 10)
+
+        self.assertEqual(cache.stats()["bytes"], 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
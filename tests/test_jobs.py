@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+from jobs import JobQueue
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.queue = JobQueue(os.path.join(directory.name, "jobs.db"))
+        self.addCleanup(self.queue._connection.close)
+
+    def test_claim_reserves_oldest_job_once(self):
+        first = self.queue.submit(["a", "b"])
+        second = self.queue.submit(["c"])
+
+        self.assertEqual(self.queue.claim().job_id, first)
+        self.assertEqual(self.queue.claim().job_id, second)
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(first)["status"], jobs.STATUS_RUNNING)
+
+    def test_expired_lease_resumes_pending_messages(self):
+        job_id = self.queue.submit(["a", "b", "c"])
+        # Lease já vencido ao ser concedido: o worker "morre" depois da primeira mensagem
+        with mock.patch.object(jobs, "JOBS_LEASE_SECONDS", -1):
+            self.queue.claim()
+            self.queue.save_result(job_id, 0, {"message": "a"})
+
+        job = self.queue.claim()
+        self.assertEqual(job.job_id, job_id)
+        self.assertEqual(job.pending_indexes, [1, 2])
+        self.assertEqual(self.queue.get(job_id)["completed"], 1)
+
+    def test_valid_lease_is_not_claimed_again(self):
+        self.queue.submit(["a"])
+        self.queue.claim()
+
+        self.assertIsNone(self.queue.claim())
+
+    def test_gives_up_after_max_attempts(self):
+        job_id = self.queue.submit(["a"])
+        with mock.patch.object(jobs, "JOBS_LEASE_SECONDS", -1), mock.patch.object(jobs, "JOBS_MAX_ATTEMPTS", 2):
+            self.assertIsNotNone(self.queue.claim())
+            self.assertIsNotNone(self.queue.claim())
+            self.assertIsNone(self.queue.claim())
+
+        self.assertEqual(self.queue.get(job_id)["status"], jobs.STATUS_FAILED)
+
+
+if __name__ == "__main__":
+    unittest.main()
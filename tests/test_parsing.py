@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsing import ParseError, extract_json, parse_poem, parse_process_description
+
+POEM = '{"title": "Manhã", "style": "Livre", "mood": "Alegre", "lines": ["primeiro verso", "segundo verso"]}'
+
+
+class ExtractJsonTest(unittest.TestCase):
+    def test_plain_json(self):
+        self.assertEqual(extract_json('{"a": 1}'), {"a": 1})
+
+    def test_markdown_fence(self):
+        self.assertEqual(extract_json('```json\n{"a": 1}\n```'), {"a": 1})
+
+    def test_comments_around_object(self):
+        self.assertEqual(extract_json('Aqui está o resultado:\n{"a": [1, 2]}\nEspero ter ajudado!'), {"a": [1, 2]})
+
+    def test_literal_newline_inside_string(self):
+        self.assertEqual(extract_json('```\n{"verso": "linha 1\nlinha 2"}\n```'), {"verso": "linha 1\nlinha 2"})
+
+    def test_truncated_output(self):
+        with self.assertRaises(ParseError):
+            extract_json('{"title": "Manhã", "lines": ["primeiro')
+
+    def test_text_without_json(self):
+        with self.assertRaises(ParseError):
+            extract_json("Desculpe, não posso ajudar com isso.")
+
+
+class ParseModelTest(unittest.TestCase):
+    def test_valid_poem_is_normalized(self):
+        poem = parse_poem(f"```json\n{POEM}\n```")
+
+        self.assertEqual(poem["title"], "Manhã")
+        self.assertEqual(poem["lines"], ["primeiro verso", "segundo verso"])
+
+    def test_missing_field(self):
+        with self.assertRaises(ParseError):
+            parse_poem('{"title": "Manhã", "style": "Livre", "mood": "Alegre"}')
+
+    def test_wrong_type(self):
+        with self.assertRaises(ParseError):
+            parse_process_description({"title": "t", "summary": "s", "steps": "um passo", "conclusion": "c"})
+
+    def test_malformed_text(self):
+        with self.assertRaises(ParseError):
+            parse_process_description("{title: sem aspas}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Provedores falsos e sem cache: o teste roda offline e toda mensagem chega ao escalonador
+os.environ.setdefault("PROVIDER_TRANSPORT", "fake")
+os.environ.setdefault("CACHE_BACKEND", "none")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services
+from pipeline import AnalysisPipeline
+from rate_limiter import RateLimitScheduler, current_client_id
+
+
+class PipelineFairnessTest(unittest.IsolatedAsyncioTestCase):
+    async def test_small_client_is_served_ahead_of_large_one(self):
+        # Uma chamada a cada 50ms e só 2 vagas: quem espera cota não pode segurar vaga
+        limiter = RateLimitScheduler(1200, 10_000_000, burst=1, name="test-fairness")
+        pipeline = AnalysisPipeline(max_concurrency=2, generation_mode="combined")
+        finished = []
+
+        async def analyze(client_id, message):
+            current_client_id.set(client_id)
+            await pipeline.combined(message)
+            finished.append(client_id)
+
+        with mock.patch.object(services, "gemini_rate_limiter", limiter):
+            large = [asyncio.create_task(analyze("large", f"Mensagem grande {i}")) for i in range(12)]
+            await asyncio.sleep(0.01)
+            small = asyncio.create_task(analyze("small", "Mensagem pequena"))
+            await asyncio.gather(small, *large)
+
+        # No rodízio por cliente a mensagem pequena é atendida logo depois das primeiras
+        # do cliente grande, em vez de esperar as 12
+        self.assertLess(finished.index("small"), 4, finished)
+
+
+if __name__ == "__main__":
+    unittest.main()
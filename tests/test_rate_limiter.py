@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import RateLimitScheduler, SQLiteQuota
+
+
+class RateLimitSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_clients_are_served_round_robin(self):
+        # Uma requisição a cada 10ms, sem rajada
+        limiter = RateLimitScheduler(6000, 10_000_000, burst=1, name="test-round-robin")
+        order = []
+
+        async def request(client_id):
+            await limiter.acquire(client_id=client_id, priority=0)
+            order.append(client_id)
+
+        tasks = [asyncio.create_task(request("grande")) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("pequeno")))
+        await asyncio.gather(*tasks)
+
+        self.assertLessEqual(order.index("pequeno"), 2, order)
+
+    async def test_lower_priority_value_goes_first(self):
+        limiter = RateLimitScheduler(6000, 10_000_000, burst=1, name="test-priority")
+        await limiter.acquire(client_id="a", priority=0)
+        order = []
+
+        async def request(client_id, priority):
+            await limiter.acquire(client_id=client_id, priority=priority)
+            order.append(client_id)
+
+        await asyncio.gather(request("lote", 1), request("interativo", 0))
+
+        self.assertEqual(order, ["interativo", "lote"])
+
+    async def test_token_budget_limits_large_requests(self):
+        # 6000 tokens por minuto: 100 por segundo
+        limiter = RateLimitScheduler(6000, 6000, name="test-tokens")
+        loop = asyncio.get_running_loop()
+        await limiter.acquire(6000, client_id="a", priority=0)
+
+        start = loop.time()
+        await limiter.acquire(10, client_id="a", priority=0)
+        self.assertGreaterEqual(loop.time() - start, 0.08)
+
+    async def test_penalize_pauses_the_queue(self):
+        limiter = RateLimitScheduler(6000, 10_000_000, name="test-penalize")
+        loop = asyncio.get_running_loop()
+
+        await limiter.penalize(0.2)
+        start = loop.time()
+        await limiter.acquire(client_id="a", priority=0)
+
+        self.assertGreaterEqual(loop.time() - start, 0.15)
+        self.assertEqual(limiter.stats()["penalties"], 1)
+
+    async def test_penalize_reschedules_waiters(self):
+        limiter = RateLimitScheduler(6000, 10_000_000, burst=1, name="test-penalize-waiting")
+        loop = asyncio.get_running_loop()
+        await limiter.acquire(client_id="a", priority=0)
+        # Já aguardando o próximo timer de 10ms quando chega o 429
+        waiting = asyncio.create_task(limiter.acquire(client_id="a", priority=0))
+        await asyncio.sleep(0)
+
+        start = loop.time()
+        await limiter.penalize(0.2)
+        await waiting
+
+        self.assertGreaterEqual(loop.time() - start, 0.15)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        limiter = RateLimitScheduler(60, 10_000_000, burst=1, name="test-cancel")
+        await limiter.acquire(client_id="a", priority=0)
+        waiting = asyncio.create_task(limiter.acquire(client_id="a", priority=0))
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(limiter.stats()["queue_depth"], 0)
+
+
+class SharedQuotaTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "rate_limit.db")
+
+    def _limiter(self, name):
+        """Um escalonador por "processo", todos sobre a mesma linha do SQLite"""
+        # 600 por minuto com rajada de 2: depois da rajada, uma requisição a cada 100ms
+        quota = SQLiteQuota("gemini-test", 600, 10_000_000, burst=2, path=self.path)
+        self.addCleanup(lambda: quota._connection and quota._connection.close())
+        return RateLimitScheduler(600, 10_000_000, name=name, quota=quota)
+
+    async def test_processes_share_the_same_quota(self):
+        first, second = self._limiter("test-shared-1"), self._limiter("test-shared-2")
+        loop = asyncio.get_running_loop()
+
+        start = loop.time()
+        await first.acquire(client_id="a", priority=0)
+        await second.acquire(client_id="b", priority=0)
+        self.assertLess(loop.time() - start, 0.05)
+
+        # A rajada foi gasta pelos dois juntos: o próximo espera o reabastecimento
+        start = loop.time()
+        await first.acquire(client_id="a", priority=0)
+        self.assertGreaterEqual(loop.time() - start, 0.05)
+        self.assertEqual(first.stats()["backend"], "sqlite")
+
+    async def test_penalty_pauses_every_process(self):
+        first, second = self._limiter("test-shared-penalty-1"), self._limiter("test-shared-penalty-2")
+        loop = asyncio.get_running_loop()
+
+        await first.penalize(0.2)
+        start = loop.time()
+        await second.acquire(client_id="b", priority=0)
+
+        self.assertGreaterEqual(loop.time() - start, 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
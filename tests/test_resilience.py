@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise httpx.ConnectError("conexão recusada")
+
+
+async def reject():
+    response = httpx.Response(400, request=httpx.Request("POST", "http://provedor"))
+    raise httpx.HTTPStatusError("requisição inválida", request=response.request, response=response)
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            "test", failure_rate_threshold=0.5, minimum_calls=4, window_seconds=30, open_seconds=0.05,
+        )
+
+    async def _calls(self, *functions):
+        for function in functions:
+            try:
+                await self.breaker.call(function)
+            except httpx.HTTPError:
+                pass
+
+    async def test_opens_when_failure_rate_reaches_threshold(self):
+        await self._calls(succeed, fail, succeed)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        await self._calls(fail)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.call(succeed)
+        self.assertEqual(self.breaker.stats()["rejected"], 1)
+
+    async def test_client_errors_do_not_open(self):
+        await self._calls(reject, reject, reject, reject, succeed)
+
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.stats()["calls_in_window"], 1)
+
+    async def test_successful_probe_closes(self):
+        await self._calls(fail, fail, fail, fail)
+        await asyncio.sleep(0.06)
+
+        self.assertEqual(await self.breaker.call(succeed), "ok")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_failed_probe_reopens(self):
+        await self._calls(fail, fail, fail, fail)
+        await asyncio.sleep(0.06)
+
+        await self._calls(fail)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+
+    async def test_half_open_limits_concurrent_probes(self):
+        await self._calls(fail, fail, fail, fail)
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(self.breaker.call(asyncio.sleep, 0.05))
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.call(succeed)
+        await probe
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_timeout_counts_as_failure(self):
+        breaker = CircuitBreaker("test-timeout", minimum_calls=1, open_seconds=5)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await breaker.call(asyncio.sleep, 1, timeout=0.01)
+        self.assertEqual(breaker.state, OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+os.environ.setdefault("PROVIDER_TRANSPORT", "fake")
+os.environ.setdefault("CACHE_BACKEND", "none")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services
+from clients import GenerationResponse
+from deadline import Deadline, current_deadline
+from rate_limiter import RateLimitScheduler
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flights = SingleFlight("test")
+        self.calls = []
+
+    async def _slow(self, value):
+        self.calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def test_concurrent_calls_share_one_execution(self):
+        results = await asyncio.gather(*(self.flights.do("chave", self._slow, 21) for _ in range(3)))
+
+        self.assertEqual(results, [42, 42, 42])
+        self.assertEqual(self.calls, [21])
+        self.assertEqual((self.flights.stats()["executed"], self.flights.stats()["shared"]), (1, 2))
+        self.assertEqual(self.flights.stats()["in_flight"], 0)
+
+    async def test_finished_call_is_not_reused(self):
+        await self.flights.do("chave", self._slow, 1)
+        await self.flights.do("chave", self._slow, 2)
+
+        self.assertEqual(self.calls, [1, 2])
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        leader = asyncio.create_task(self.flights.do("chave", self._slow, 1))
+        follower = asyncio.create_task(self.flights.do("chave", self._slow, 1))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        self.assertEqual(await follower, 2)
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+    async def test_call_is_cancelled_when_nobody_waits(self):
+        cancelled = asyncio.Event()
+
+        async def blocked():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(self.flights.do("chave", blocked)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(self.flights.stats()["in_flight"], 0)
+
+    async def test_do_many_runs_only_missing_keys(self):
+        async def batch(keys):
+            self.calls.append(list(keys))
+            await asyncio.sleep(0.05)
+            return [key.upper() for key in keys]
+
+        first = asyncio.create_task(self.flights.do_many(["a", "b"], batch))
+        await asyncio.sleep(0.01)
+        second = await self.flights.do_many(["b", "c"], batch)
+
+        self.assertEqual(await first, {"a": "A", "b": "B"})
+        self.assertEqual(second, {"b": "B", "c": "C"})
+        self.assertEqual(self.calls, [["a", "b"], ["c"]])
+
+
+class SingleFlightDeadlineTest(unittest.IsolatedAsyncioTestCase):
+    async def _leader_and_follower(self):
+        """Líder com 0.2s de prazo; 50ms depois entra um seguidor com 5s na mesma chave"""
+        flights = SingleFlight("test-deadline")
+
+        async def call(timeout, delay):
+            await asyncio.sleep(delay)
+            current_deadline.set(Deadline(timeout))
+            try:
+                return await flights.do("chave", services.create_juice, "prompt")
+            except TimeoutError:
+                return "timeout"
+
+        return await asyncio.gather(call(0.2, 0), call(5, 0.05))
+
+    async def test_short_deadline_alone_times_out(self):
+        async def slow_generation(contents, generation_config, kind):
+            await asyncio.sleep(0.4)
+            return GenerationResponse("ok")
+
+        flights = SingleFlight("test-deadline-alone")
+        current_deadline.set(Deadline(0.2))
+        limiter = RateLimitScheduler(6000, 10_000_000, name="test-deadline-alone")
+        with mock.patch.object(services, "gemini_rate_limiter", limiter), \
+                mock.patch.object(services, "_generate_once", slow_generation):
+            with self.assertRaises(TimeoutError):
+                await flights.do("chave", services.create_juice, "prompt")
+
+    async def test_follower_extends_running_call(self):
+        async def slow_generation(contents, generation_config, kind):
+            await asyncio.sleep(0.4)
+            return GenerationResponse("ok")
+
+        limiter = RateLimitScheduler(6000, 10_000_000, name="test-deadline")
+        with mock.patch.object(services, "gemini_rate_limiter", limiter), \
+                mock.patch.object(services, "_generate_once", slow_generation):
+            leader, follower = await self._leader_and_follower()
+
+        # O prazo estendido pelo seguidor vale para a chamada já em andamento
+        self.assertEqual((leader.text, follower.text), ("ok", "ok"))
+
+    async def test_follower_extends_rate_limiter_wait(self):
+        async def generation(contents, generation_config, kind):
+            return GenerationResponse("ok")
+
+        # Uma chamada a cada 0.4s: a cota do líder só sai depois do prazo dele
+        limiter = RateLimitScheduler(150, 10_000_000, burst=1, name="test-deadline-wait")
+        await limiter.acquire()
+        with mock.patch.object(services, "gemini_rate_limiter", limiter), \
+                mock.patch.object(services, "_generate_once", generation):
+            leader, follower = await self._leader_and_follower()
+
+        self.assertEqual((leader.text, follower.text), ("ok", "ok"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+
+from metrics import app_ready
+
+logger = logging.getLogger(__name__)
+
+# "background" (padrão): o servidor aceita conexões na hora e o aquecimento roda em segundo
+# plano, com /readyz respondendo 503 até terminar; "blocking": o startup só termina depois dele
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+PENDING = "pending"
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+
+
+class _Step:
+    __slots__ = ("name", "function", "required", "timeout", "status", "seconds", "error", "result")
+
+    def __init__(self, name, function, required, timeout):
+        self.name = name
+        self.function = function
+        self.required = required
+        self.timeout = timeout
+        self.status = PENDING
+        self.seconds = None
+        self.error = None
+        self.result = None
+
+
+class Warmup:
+    """
+    Etapas de aquecimento do startup (modelo local, análises pré-computadas, conexões).\n
+    As etapas rodam concorrentemente, cada uma com o próprio tempo limite. A aplicação está
+    pronta quando todas terminaram e nenhuma etapa obrigatória falhou: uma etapa opcional
+    que falha (ex.: pré-conexão com um provedor fora do ar) só é registrada, já que o
+    primeiro uso refaz o trabalho sob demanda.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._steps = {}
+        self._task = None
+        app_ready.set_function(lambda: 1 if self.ready else 0)
+
+    def add(self, name, function, required=True, timeout=None):
+        """Registra `function` (sem argumentos, devolve um awaitable) como etapa do aquecimento"""
+        self._steps[name] = _Step(name, function, required, timeout)
+
+    async def _run_step(self, step):
+        step.status = RUNNING
+        start_time = time.perf_counter()
+        try:
+            step.result = await asyncio.wait_for(step.function(), step.timeout)
+            step.status = OK
+        except Exception as e:
+            step.status = FAILED
+            step.error = repr(e)
+            log = logger.error if step.required else logger.warning
+            log(f"Etapa de aquecimento '{step.name}' falhou: {step.error}")
+        finally:
+            step.seconds = time.perf_counter() - start_time
+
+    async def run(self):
+        self.finished_at = None
+        steps = [step for step in self._steps.values() if step.status == PENDING]
+        await asyncio.gather(*(self._run_step(step) for step in steps))
+        self.finished_at = time.monotonic()
+        logger.info(
+            f"Aquecimento concluído em {self.finished_at - self.started_at:.2f}s "
+            f"({', '.join(f'{step.name}: {step.status}' for step in steps)})"
+        )
+
+    async def start(self, mode=STARTUP_WARMUP):
+        """Executa o aquecimento agora ("blocking") ou em uma task de fundo ("background")"""
+        if mode == "blocking":
+            await self.run()
+        else:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def ready(self):
+        return self.finished and not any(
+            step.required and step.status != OK for step in self._steps.values()
+        )
+
+    def status(self):
+        if self.ready:
+            return "ready"
+        return "failed" if self.finished else "starting"
+
+    def stats(self):
+        return {
+            "status": self.status(),
+            "uptime_seconds": time.monotonic() - self.started_at,
+            "warmup_seconds": self.finished_at - self.started_at if self.finished else None,
+            "steps": {
+                step.name: {
+                    "status": step.status,
+                    "required": step.required,
+                    "seconds": step.seconds,
+                    **({"error": step.error} if step.error else {}),
+                    **({"result": step.result} if step.result is not None else {}),
+                }
+                for step in self._steps.values()
+            },
+        }
+
+
+startup_warmup = Warmup()
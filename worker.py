@@ -1,26 +1,88 @@
+from os.path import join, dirname
+from dotenv import load_dotenv
+
+# O .env é carregado uma única vez, aqui no ponto de entrada, antes dos módulos que leem
+# a configuração ao serem importados
+load_dotenv(join(dirname(__file__), '.env'))
+
+from clients import init_clients, close_clients
+from jobs import get_job_queue
+from pipeline import default_pipeline
+from rate_limiter import current_client_id, current_priority, PRIORITY_BACKGROUND
+from observability import setup_logging
+from sentiment_backends import get_sentiment_backend
+import asyncio
 import logging
 import os
 import time
 
 # Configuração do sistema de logging
 log_directory = "logs"
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"{log_directory}/worker.log"),
-        logging.StreamHandler()
-    ]
-)
+setup_logging(f"{log_directory}/worker.log")
 
 logger = logging.getLogger(__name__)
 
-# Este arquivo está desativado já que não usamos mais Redis para o processamento assíncrono.
-# Mantido para referência futura.
+# Intervalo entre consultas à fila quando não há jobs disponíveis
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 1.0))
+# Número de jobs processados ao mesmo tempo por processo de worker
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", 2))
+
+
+async def process_job(queue, job):
+    """Analisa as mensagens pendentes do job e grava cada resultado assim que fica pronto"""
+    logger.info(f"Processando job {job.job_id}: {len(job.pending_indexes)}/{len(job.messages)} mensagens pendentes")
+    start_time = time.time()
+
+    # Jobs competem pela cota do Gemini com prioridade menor que as requisições interativas
+    current_priority.set(PRIORITY_BACKGROUND)
+    current_client_id.set(f"job:{job.job_id}")
+
+    try:
+        pending_messages = [job.messages[index] for index in job.pending_indexes]
+        async for local_index, result in default_pipeline.stream(pending_messages):
+            await asyncio.to_thread(queue.save_result, job.job_id, job.pending_indexes[local_index], result.dict())
+        await asyncio.to_thread(queue.complete, job.job_id)
+        logger.info(f"Job {job.job_id} finalizado em {time.time() - start_time:.2f} segundos")
+    except Exception as e:
+        logger.exception(f"Erro ao processar job {job.job_id}")
+        await asyncio.to_thread(queue.fail, job.job_id, str(e))
+
+
+async def run_worker():
+    queue = get_job_queue()
+    init_clients()
+    await asyncio.to_thread(get_sentiment_backend().load)
+    await asyncio.to_thread(default_pipeline.precomputed.load)
+    slots = asyncio.Semaphore(WORKER_MAX_JOBS)
+    running = set()
+    logger.info(f"Worker iniciado (até {WORKER_MAX_JOBS} jobs simultâneos, fila em {queue.path})")
+
+    async def run_job(job):
+        try:
+            await process_job(queue, job)
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            job = await asyncio.to_thread(queue.claim)
+            if job is None:
+                slots.release()
+                await asyncio.sleep(WORKER_POLL_INTERVAL)
+                continue
+
+            task = asyncio.create_task(run_job(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+        await close_clients()
+
 
 if __name__ == "__main__":
-    logger.info("Worker desativado - processamento assíncrono não está disponível sem Redis")
-    logger.info("Todas as operações agora são síncronas")
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        logger.info("Worker encerrado")